@@ -0,0 +1,205 @@
+import asyncio
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .apigpio import _monotonic_ns
+
+
+def mcp3008(channel, differential=False):
+    """
+    Returns the (request, decode) pair reading a channel of an MCP3008
+    (or MCP3004) 10 bit ADC, for SpiSampler.
+
+         channel:= 0-7.
+    differential:= True for a differential reading.
+    """
+    mode = 0 if differential else 0x80
+    request = bytes((1, mode | (channel << 4), 0))
+
+    def decode(rx):
+        return ((rx[1] & 3) << 8) | rx[2]
+    return request, decode
+
+
+class SpiSampler(object):
+    """
+    Samples an SPI ADC continuously, keeping a fixed number of transfers
+    in flight on the command connection, so that the sampling rate is not
+    bound by the round trip time to gpiod.
+
+    Decoded samples and their host time (monotonic, in nanoseconds, taken
+    when the reply is received) are written in preallocated NumPy ring
+    buffers.
+
+    ...
+    h = yield from pi.spi_open(0, 1000000)
+    request, decode = apigpio.adc.mcp3008(0)
+    sampler = SpiSampler(pi, h, request, decode, rate=2000)
+    yield from sampler.start()
+    yield from asyncio.sleep(1)
+    times, values = sampler.window(0.5)  # samples of the last 500 ms
+    print(sampler.stats())
+    yield from sampler.stop()
+    ...
+    """
+
+    def __init__(self, pi, handle, request, decode, size=65536, in_flight=4,
+                 rate=None, dtype='uint16'):
+        """
+           handle:= an SPI handle, as returned by spi_open.
+          request:= the bytes sent to the ADC for each sample.
+           decode:= function returning the sample from the bytes read.
+             size:= number of samples kept in the ring buffer.
+        in_flight:= number of transfers pending at the same time.
+             rate:= target number of samples per second, as fast as
+                    possible if None.
+            dtype:= NumPy type of the samples.
+        """
+        if np is None:
+            raise ImportError('apigpio adc sampling requires numpy')
+        self._pi = pi
+        self._handle = handle
+        self._request = bytes(request)
+        self._decode = decode
+        self._in_flight = in_flight
+        self.rate = rate
+        self.values = np.zeros(size, dtype=dtype)
+        self.times = np.zeros(size, dtype=np.int64)
+        # total number of samples since the sampler started
+        self.count = 0
+        # failed transfers and transfers started later than their slot
+        self.errors = 0
+        self.late = 0
+        # the error which stopped the sampling, if any
+        self.exception = None
+        self._workers = []
+        self._slot = 0
+        self._start = None
+        self._stop = None
+
+    @property
+    def dropped(self):
+        """Number of samples overwritten because the buffer was full."""
+        return max(0, self.count - len(self.values))
+
+    def __len__(self):
+        return min(self.count, len(self.values))
+
+    @asyncio.coroutine
+    def start(self):
+        """Starts sampling."""
+        if self._workers:
+            return
+        loop = self._pi._loop
+        self._slot = 0
+        self._start = loop.time()
+        self._stop = None
+        self.exception = None
+        self._workers = [asyncio.async(self._run(), loop=loop)
+                         for _ in range(self._in_flight)]
+
+    @asyncio.coroutine
+    def stop(self):
+        """Stops sampling, the samples are kept."""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            try:
+                yield from worker
+            except asyncio.CancelledError:
+                pass
+        if workers and self._stop is None:
+            self._stop = self._pi._loop.time()
+
+    def clear(self):
+        """Discards all the samples."""
+        self.count = 0
+
+    @asyncio.coroutine
+    def _run(self):
+        loop = self._pi._loop
+        buf = bytearray(len(self._request))
+        while self.exception is None:
+            if self.rate:
+                # each transfer has its own slot, whichever worker runs it
+                slot = self._start + self._slot / self.rate
+                self._slot += 1
+                delay = slot - loop.time()
+                if delay > 0:
+                    yield from asyncio.sleep(delay, loop=loop)
+                elif delay < -1 / self.rate:
+                    self.late += 1
+            try:
+                count, data = yield from self._pi.spi_xfer(
+                    self._handle, self._request, buf)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # gpiod or the connection failed: all the workers stop
+                self.errors += 1
+                self.exception = e
+                self._stop = loop.time()
+                return
+            if count < len(self._request):
+                self.errors += 1
+                continue
+            pos = self.count % len(self.values)
+            self.values[pos] = self._decode(data)
+            self.times[pos] = _monotonic_ns()
+            self.count += 1
+
+    def _segments(self):
+        # (older, newer) slices of the ring buffers, in sampling order
+        size = len(self.values)
+        if self.count <= size:
+            return slice(0, 0), slice(0, self.count)
+        pos = self.count % size
+        return slice(pos, size), slice(0, pos)
+
+    def _ordered(self, array, older, newer):
+        if older.start == older.stop:
+            return array[newer]
+        return np.concatenate((array[older], array[newer]))
+
+    def samples(self):
+        """
+        Returns the (times, values) arrays of all the samples in sampling
+        order, views of the buffers when they are contiguous in them,
+        otherwise copies.
+        """
+        older, newer = self._segments()
+        return (self._ordered(self.times, older, newer),
+                self._ordered(self.values, older, newer))
+
+    def window(self, duration):
+        """
+        Returns the (times, values) arrays of the samples of the last
+        duration seconds.
+        """
+        times, values = self.samples()
+        if not len(times):
+            return times, values
+        since = times[-1] - int(duration * 1000000000)
+        first = np.searchsorted(times, since, side='right')
+        return times[first:], values[first:]
+
+    def stats(self):
+        """
+        Returns a dict with the number of samples, the achieved rate in
+        samples per second, and the numbers of dropped, failed and late
+        samples.
+        """
+        rate = 0.0
+        if self._start is not None:
+            end = self._stop
+            if end is None:
+                end = self._pi._loop.time()
+            if end > self._start:
+                rate = self.count / (end - self._start)
+        return {'samples': self.count, 'rate': rate,
+                'dropped': self.dropped, 'errors': self.errors,
+                'late': self.late}
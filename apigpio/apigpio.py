@@ -1,12 +1,18 @@
 import asyncio
+import collections
+import logging
 import socket
 import struct
 import sys
+import time
 import functools
 from .ctes import *
+from .wave import pack_pulses, WaveCache
 
 exceptions = True
 
+logger = logging.getLogger(__name__)
+
 # pigpio command numbers
 _PI_CMD_MODES = 0
 _PI_CMD_MODEG = 1
@@ -252,10 +258,45 @@ _errors = [
 ]
 
 
+# size of the chunks read from the command and notification sockets
+_RX_CHUNK = 65536
+
+# commands which may carry or return large amounts of data, they are sent on
+# the bulk connection when there is one.
+_BULK_CMDS = frozenset([
+    _PI_CMD_PROC, _PI_CMD_WVAG, _PI_CMD_WVAS, _PI_CMD_WVCHA,
+    _PI_CMD_I2CRD, _PI_CMD_I2CWD, _PI_CMD_I2CRK, _PI_CMD_I2CWK,
+    _PI_CMD_I2CRI, _PI_CMD_I2CWI, _PI_CMD_I2CPK, _PI_CMD_I2CZ,
+    _PI_CMD_BI2CZ, _PI_CMD_SPIR, _PI_CMD_SPIW, _PI_CMD_SPIX,
+    _PI_CMD_SERR, _PI_CMD_SERW, _PI_CMD_SLR,
+])
+
+# bank set and clear commands: (first gpio of the bank, level set)
+_BANK_CMDS = {
+    _PI_CMD_BS1: (0, 1), _PI_CMD_BC1: (0, 0),
+    _PI_CMD_BS2: (32, 1), _PI_CMD_BC2: (32, 0),
+}
+
+_CMD = struct.Struct('IIII')
+_RES = struct.Struct('I')
+_RES_SIZE = 16
+
+# notification report: seq, flags, tick, level
+_REPORT = struct.Struct('HHII')
+_REPORT_SIZE = 12
+
+
 class ApigpioError(Exception):
-    """pigpio module exception"""
-    def __init__(self, value):
+    """
+    pigpio module exception
+
+    value:= the error description.
+     code:= the pigpio error number (<0) for errors returned by gpiod,
+            otherwise None.
+    """
+    def __init__(self, value, code=None):
         self.value = value
+        self.code = code
 
     def __str__(self):
         return repr(self.value)
@@ -298,6 +339,20 @@ else:
         return x
 
 
+def _nbytes(data):
+    """Returns the size in bytes of str, bytes or any buffer."""
+    if isinstance(data, (str, bytes, bytearray)):
+        return len(data)
+    return memoryview(data).nbytes
+
+
+if hasattr(time, 'monotonic_ns'):
+    _monotonic_ns = time.monotonic_ns
+else:
+    def _monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+
+
 def u2i(uint32):
     """
     Converts a 32 bit unsigned number to signed.
@@ -328,35 +383,93 @@ def _u2i(uint32):
     v = u2i(uint32)
     if v < 0:
         if exceptions:
-            raise ApigpioError(error_text(v))
+            raise ApigpioError(error_text(v), v)
     return v
 
 
 class _callback_ADT:
     """An ADT class to hold callback information."""
 
-    def __init__(self, gpio, edge, func):
+    __slots__ = ('gpio', 'edge', 'bit', 'func', 'dropped', 'extended',
+                 '_func', '_notify', '_pending', '_worker')
+
+    def __init__(self, gpio, edge, func, notify=None, extended=False):
         """
         Initialises a callback ADT.
 
         gpio:= Broadcom gpio number.
         edge:= EITHER_EDGE, RISING_EDGE, or FALLING_EDGE.
-        func:= a user function taking three arguments (gpio, level, tick).
+        func:= a user function taking three arguments (gpio, level, tick),
+               or a coroutine function.
+        notify:= the _callback_handler reporting errors raised by func.
+        extended:= if True, func receives the 64 bit extended tick instead
+                   of the 32 bit tick.
         """
         self.gpio = gpio
         self.edge = edge
+        self.extended = extended
         self._func = func
+        self._notify = notify
         self.bit = 1 << gpio
+        self.dropped = 0
+        self._worker = None
+        # Bound once here: running the callback does not allocate anything.
+        if asyncio.iscoroutinefunction(func):
+            self._pending = collections.deque()
+            self.func = self._queued
+        else:
+            self._pending = None
+            self.func = self._guarded
+
+    def _guarded(self, gpio, level, tick, etick):
+        if self.extended:
+            tick = etick
+        # protect our-self from faulty callbacks
+        try:
+            self._func(gpio, level, tick)
+        except Exception as e:
+            if self._notify is None:
+                logger.exception('Exception raised when running callback')
+            else:
+                self._notify.callback_error(self._func, e)
+
+    def _queued(self, gpio, level, tick, etick):
+        if self.extended:
+            tick = etick
+        # Coroutine callbacks are queued and run one after the other, in
+        # order, by a single worker task per callback.
+        pending = self._pending
+        if len(pending) >= self._notify.queue_size:
+            pending.popleft()
+            self.dropped += 1
+        pending.append((gpio, level, tick))
+        if self._worker is None:
+            self._worker = self._notify._loop.create_task(self._run_queued())
 
-    @property
-    def func(self):
-        def _f(*args, **kwargs):
-            # protect our-self from faulty callbacks
-            try:
-                self._func(*args, **kwargs)
-            except Exception as e:
-                print('Exception raised when running callback {}'.format(e))
-        return _f
+    @asyncio.coroutine
+    def _run_queued(self):
+        notify = self._notify
+        pending = self._pending
+        try:
+            while pending:
+                gpio, level, tick = pending.popleft()
+                # bounds the number of coroutine callbacks running at once
+                yield from notify.slots.acquire()
+                try:
+                    yield from self._func(gpio, level, tick)
+                except Exception as e:
+                    notify.callback_error(self._func, e)
+                finally:
+                    notify.slots.release()
+        finally:
+            self._worker = None
+
+    def cancel_pending(self):
+        """Drops the queued calls of a coroutine callback."""
+        if self._pending:
+            self._pending.clear()
+        if self._worker is not None:
+            self._worker.cancel()
 
 
 class _callback_handler(object):
@@ -366,14 +479,43 @@ class _callback_handler(object):
     only used to listen for notifications.
     """
 
-    def __init__(self, pi):
+    def __init__(self, pi, concurrency=8, queue_size=1024):
         self._loop = pi._loop
         self.pi = pi
+        # coroutine callbacks: number which may run at the same time and
+        # maximum number of calls queued for each of them.
+        self.slots = asyncio.Semaphore(concurrency, loop=self._loop)
+        self.queue_size = queue_size
         self.handle = None
         self.monitor = 0
-        self.callbacks = []
-        self.f_stop = asyncio.Future(loop=self._loop)
-        self.f_stopped = asyncio.Future(loop=self._loop)
+        # levels of the bank 1 gpios, kept current for the monitored ones
+        self.levels = 0
+        # 64 bit extended tick of the last report and (tick, host time in
+        # nanoseconds) pair used to convert ticks to host time.
+        self.last_tick = 0
+        self._clock_ref = None
+        # Dispatch tables, indexed by gpio: the callbacks to run on a rising
+        # edge, on a falling edge and on a watchdog timeout (all of them).
+        # Entries are tuples, which are replaced when callbacks are added
+        # or removed, so that dispatching never iterates over a list being
+        # modified.
+        self._rising = [()] * 32
+        self._falling = [()] * 32
+        self._all = [()] * 32
+        # Sinks receive the raw reports of each chunk, before they are
+        # dispatched to callbacks, see add_sink().
+        self._sinks = {}
+        self._sink_funcs = ()
+        self._reader = None
+        self.error_handler = None
+        # Consumers which asked the reader to stop reading reports until
+        # they have caught up, see pause().
+        self._paused = set()
+        self._resumed = None
+        # futures waited for with wait(), and the error which stopped the
+        # notifications, if any.
+        self._waiters = set()
+        self.exception = None
 
     @asyncio.coroutine
     def _connect(self, address):
@@ -387,92 +529,265 @@ class _callback_handler(object):
         # TODO: handle connection errors !
         yield from self._loop.sock_connect(self.s, address)
         self.handle = yield from self._pigpio_aio_command(_PI_CMD_NOIB, 0, 0)
-        asyncio.async(self._wait_for_notif())
+        # gpiod only sends the keep alive reports, which the extended ticks
+        # rely on not to miss a wrap, once the notification is started.
+        yield from self.pi._pigpio_aio_command(_PI_CMD_NB, self.handle, 0)
+        yield from self.sync_clock()
+        self._reader = asyncio.async(self._wait_for_notif(), loop=self._loop)
 
     @asyncio.coroutine
     def close(self):
-        if not self.f_stop.done():
-            self.handle = yield from self._pigpio_aio_command(_PI_CMD_NC,
-                                                              self.handle, 0)
-            self.f_stop.set_result(True)
-            yield from self.f_stopped
+        if self._reader is not None:
+            yield from self.pi._pigpio_aio_command(_PI_CMD_NC, self.handle, 0)
+            self._reader.cancel()
+            yield from asyncio.wait([self._reader], loop=self._loop)
+            self._reader = None
+            self.s.close()
+            for callbacks in self._all:
+                for cb in callbacks:
+                    cb.cancel_pending()
 
     @asyncio.coroutine
     def _wait_for_notif(self):
 
-        last_level = 0
+        # Reports are received in large chunks, in a buffer which is reused
+        # for the whole life of the connection. A partial report at the end
+        # of a chunk is moved to the start of the buffer and completed by
+        # the next one.
+        buf = bytearray(_RX_CHUNK)
+        view = memoryview(buf)
+        carry = 0
+        recv_into = getattr(self._loop, 'sock_recv_into', None)
+
+        try:
+            while True:
+                if recv_into is not None:
+                    n = yield from recv_into(self.s, view[carry:])
+                else:
+                    chunk = yield from self._loop.sock_recv(self.s,
+                                                            _RX_CHUNK - carry)
+                    n = len(chunk)
+                    view[carry:carry + n] = chunk
+                if not n:
+                    raise ApigpioError('connection closed by gpiod')
+                n += carry
+                end = n - n % _REPORT_SIZE
+                monitor = self.monitor
+                rising = self._rising
+                falling = self._falling
+                all_ = self._all
+
+                for sink in self._sink_funcs:
+                    # a faulty sink must not stop the notifications
+                    try:
+                        sink(view[:end])
+                    except Exception as e:
+                        self.callback_error(sink, e)
+
+                last_level = self.levels
+                last_tick = self.last_tick
+                for seq, flags, tick, level in _REPORT.iter_unpack(view[:end]):
+                    # Ticks are monotonic and keep alive reports are sent at
+                    # least every minute, so the time elapsed since the last
+                    # report is the difference of the ticks modulo 2**32.
+                    last_tick += (tick - last_tick) & 0xFFFFFFFF
+                    if flags == 0:
+                        changed = (level ^ last_level) & monitor
+                        last_level = level
+                        # only visit the gpios which actually changed
+                        while changed:
+                            bit = changed & -changed
+                            changed ^= bit
+                            gpio = bit.bit_length() - 1
+                            if level & bit:
+                                for cb in rising[gpio]:
+                                    cb.func(gpio, 1, tick, last_tick)
+                            else:
+                                for cb in falling[gpio]:
+                                    cb.func(gpio, 0, tick, last_tick)
+                    elif flags & NTFY_FLAGS_WDOG:
+                        # no edge during the watchdog timeout, all the
+                        # callbacks of the gpio are called whatever their edge
+                        gpio = flags & NTFY_FLAGS_GPIO
+                        for cb in all_[gpio]:
+                            cb.func(gpio, TIMEOUT, tick, last_tick)
+                    # keep alive reports only carry the tick
+                    # no event for now
+                    # elif flags & NTFY_FLAGS_EVENT:
+                    #    event = flags & NTFY_FLAGS_GPIO
+                    #    for cb in self.events:
+                    #        if cb.event == event:
+                    #            cb.func(event, tick)
+
+                self.levels = last_level
+                self.last_tick = last_tick
+                carry = n - end
+                view[:carry] = view[end:n]
+
+                while self._paused:
+                    self._resumed = asyncio.Future(loop=self._loop)
+                    yield from self._resumed
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error('Notifications from gpiod stopped: %s', e)
+            self._stopped(e)
+
+    def _stopped(self, exc):
+        # Callbacks won't be called anymore and levels aren't kept current:
+        # the coroutines waiting for an edge fail instead of hanging.
+        self.exception = exc
+        waiters, self._waiters = self._waiters, set()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc)
 
-        while True:
-            MSG_SIZ = 12
-            f_recv = self._loop.sock_recv(self.s, MSG_SIZ)
-            done, pending = yield from asyncio.\
-                wait([f_recv, self.f_stop],
-                     return_when=asyncio.FIRST_COMPLETED)
-            if self.f_stop in done:
-                break
-            else:
-                buf = f_recv.result()
-            # buf = yield from self._loop.sock_recv(self.s, MSG_SIZ)
-
-            while len(buf) < MSG_SIZ:
-                yield from self._loop.sock_recv(self.s, MSG_SIZ-len(buf))
-
-            seq, flags, tick, level = (struct.unpack('HHII', buf))
-            if flags == 0:
-                changed = level ^ last_level
-                last_level = level
-                for cb in self.callbacks:
-                    if cb.bit & changed:
-                        new_level = 0
-                        if cb.bit & level:
-                            new_level = 1
-                        if cb.edge ^ new_level:
-                            cb.func(cb.gpio, new_level, tick)
-            else:
-                if flags & NTFY_FLAGS_WDOG:
-                    print('watchdog signal')
-                    gpio = flags & NTFY_FLAGS_GPIO
-                    for cb in self.callbacks:
-                        if cb.gpio == gpio:
-                            cb.func(cb.gpio, TIMEOUT, tick)
-                if flags & NTFY_FLAGS_ALIVE:
-                    print('keep alive signal')
-                # no event for now
-                # elif flags & NTFY_FLAGS_EVENT:
-                #    event = flags & NTFY_FLAGS_GPIO
-                #    for cb in self.events:
-                #        if cb.event == event:
-                #            cb.func(event, tick)
-        self.s.close()
-        self.f_stopped.set_result(True)
+    @asyncio.coroutine
+    def wait(self, fut):
+        """
+        Waits for a future set by a callback, which fails with the error
+        which stopped the notifications if they stop first.
+        """
+        if self.exception is not None:
+            raise self.exception
+        self._waiters.add(fut)
+        try:
+            return (yield from fut)
+        finally:
+            self._waiters.discard(fut)
+
+    def extend_tick(self, tick):
+        """
+        Returns the 64 bit extended tick for a 32 bit tick less than about
+        35 minutes away from the last report.
+        """
+        delta = (tick - self.last_tick) & 0xFFFFFFFF
+        if delta & 0x80000000:
+            delta -= 0x100000000
+        return self.last_tick + delta
+
+    @asyncio.coroutine
+    def sync_clock(self):
+        """
+        Reads the current tick and records it along with the host time, as
+        reference to convert ticks to host time.
+        """
+        before = _monotonic_ns()
+        tick = yield from self.pi._pigpio_aio_command(_PI_CMD_TICK, 0, 0)
+        after = _monotonic_ns()
+        if self._clock_ref is None:
+            self.last_tick = tick
+        self._clock_ref = (self.extend_tick(tick), (before + after) // 2)
+
+    def host_time_ns(self, etick):
+        """
+        Returns the host time.monotonic_ns() corresponding to an extended
+        tick.
+        """
+        ref_tick, ref_ns = self._clock_ref
+        return ref_ns + (etick - ref_tick) * 1000
+
+    def pause(self, consumer):
+        """
+        Stops reading reports, once the current chunk has been dispatched,
+        until resume is called for the consumer.
+        """
+        self._paused.add(consumer)
+
+    def resume(self, consumer):
+        self._paused.discard(consumer)
+        if not self._paused and self._resumed is not None \
+                and not self._resumed.done():
+            self._resumed.set_result(None)
+
+    def callback_error(self, func, exc):
+        """Reports an exception raised by the callback func."""
+        if self.error_handler is not None:
+            try:
+                self.error_handler(func, exc)
+                return
+            except Exception:
+                logger.exception('Exception raised by callback error handler')
+        logger.error('Exception raised when running callback %r', func,
+                     exc_info=exc)
 
     @asyncio.coroutine
     def append(self, cb):
         """Adds a callback."""
-        self.callbacks.append(cb.callb)
-        self.monitor = self.monitor | cb.callb.bit
-
-        yield from self.pi._pigpio_aio_command(_PI_CMD_NB, self.handle,
-                                               self.monitor)
+        cb = cb.callb
+        gpio = cb.gpio
+        self._all[gpio] += (cb,)
+        if cb.edge != FALLING_EDGE:
+            self._rising[gpio] += (cb,)
+        if cb.edge != RISING_EDGE:
+            self._falling[gpio] += (cb,)
+        yield from self._update_monitor()
 
     @asyncio.coroutine
     def remove(self, cb):
         """Removes a callback."""
-        if cb in self.callbacks:
-            self.callbacks.remove(cb)
-            new_monitor = 0
-            for c in self.callbacks:
-                new_monitor |= c.bit
-            if new_monitor != self.monitor:
-                self.monitor = new_monitor
-                yield from self.pi._pigpio_aio_command(
-                    _PI_CMD_NB, self.handle, self.monitor)
+        gpio = cb.gpio
+        if cb in self._all[gpio]:
+            for table in (self._all, self._rising, self._falling):
+                table[gpio] = tuple(c for c in table[gpio] if c is not cb)
+            cb.cancel_pending()
+            yield from self._update_monitor()
+
+    @asyncio.coroutine
+    def add_sink(self, sink, bits):
+        """
+        Adds a sink, a function called with a buffer holding all the
+        complete reports of each chunk received.
+
+        sink:= a function taking a memoryview on the packed reports, which
+               is only valid during the call.
+        bits:= mask of the gpios whose changes must be reported.
+        """
+        self._sinks[sink] = bits
+        self._sink_funcs = tuple(self._sinks)
+        yield from self._update_monitor()
+
+    @asyncio.coroutine
+    def remove_sink(self, sink):
+        """Removes a sink."""
+        if self._sinks.pop(sink, None) is not None:
+            self._sink_funcs = tuple(self._sinks)
+            yield from self._update_monitor()
+
+    @asyncio.coroutine
+    def _update_monitor(self):
+        monitor = 0
+        for gpio, callbacks in enumerate(self._all):
+            if callbacks:
+                monitor |= 1 << gpio
+        for bits in self._sinks.values():
+            monitor |= bits
+        if monitor != self.monitor:
+            added = monitor & ~self.monitor
+            self.monitor = monitor
+            yield from self.pi._pigpio_aio_command(_PI_CMD_NB, self.handle,
+                                                   self.monitor)
+            if added:
+                # initial level of the newly monitored gpios, which are
+                # then kept current by the reports.
+                levels = yield from self.pi.read_bank_1()
+                self.levels = (self.levels & ~added) | (levels & added)
+
+    def level(self, gpio):
+        """
+        Returns the level of a monitored gpio, None if it is not monitored
+        or if the notifications stopped.
+        """
+        if self.exception is None and gpio < 32 and \
+                self.monitor & (1 << gpio):
+            return (self.levels >> gpio) & 1
+        return None
 
     @asyncio.coroutine
     def _pigpio_aio_command(self, cmd,  p1, p2,):
         # FIXME: duplication with pi._pigpio_aio_command
         data = struct.pack('IIII', cmd, p1, p2, 0)
-        self._loop.sock_sendall(self.s, data)
+        yield from self._loop.sock_sendall(self.s, data)
         response = yield from self._loop.sock_recv(self.s, 16)
         _, res = struct.unpack('12sI', response)
         return res
@@ -481,7 +796,8 @@ class _callback_handler(object):
 class Callback:
     """A class to provide gpio level change callbacks."""
 
-    def __init__(self, notify, user_gpio, edge=RISING_EDGE, func=None):
+    def __init__(self, notify, user_gpio, edge=RISING_EDGE, func=None,
+                 extended_tick=False):
         """
         Initialise a callback and adds it to the notification thread.
         """
@@ -489,7 +805,8 @@ class Callback:
         self.count = 0
         if func is None:
             func = self._tally
-        self.callb = _callback_ADT(user_gpio, edge, func)
+        self.callb = _callback_ADT(user_gpio, edge, func, notify,
+                                   extended_tick)
         # FIXME yield from self._notify.append(self.callb)
 
     @asyncio.coroutine
@@ -511,6 +828,705 @@ class Callback:
         """
         return self.count
 
+    def dropped(self):
+        """
+        Returns how many calls of a coroutine callback have been dropped
+        because it could not keep up with the edges.
+        """
+        return self.callb.dropped
+
+
+class EdgeStream(object):
+    """
+    An asynchronous iterator over the edges detected on a set of gpios,
+    yielding (gpio, level, tick) tuples.
+
+    Edges are queued by a callback registered on each gpio and consumed at
+    the pace of the reader, so that a slow consumer never stalls the
+    notification socket. When the queue is full, the overflow policy
+    decides what happens to new edges:
+
+    . .
+    'drop_oldest': the oldest queued edge is dropped.
+    'coalesce': the new edge replaces the queued edge of the same gpio,
+                if any, otherwise the oldest queued edge is dropped.
+    'block': reports are no longer read from gpiod until the queue has
+             been drained, the edges already received are still queued.
+    . .
+
+    The received, dropped and coalesced counters tell how many edges were
+    shed under load.
+
+    ...
+    async for gpio, level, tick in pi.edges([18, 23], apigpio.EITHER_EDGE):
+        print(gpio, level, tick)
+    ...
+    """
+
+    def __init__(self, pi, gpios, edge=EITHER_EDGE, maxsize=1024,
+                 overflow='drop_oldest', extended_tick=False):
+        if overflow not in ('drop_oldest', 'coalesce', 'block'):
+            raise ValueError('unknown overflow policy {}'.format(overflow))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self._pi = pi
+        self._loop = pi._loop
+        self._notify = pi._notify
+        self._gpios = list(gpios)
+        self._edge = edge
+        self._extended_tick = extended_tick
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._queue = collections.deque()
+        # coalesce policy: gpio -> its most recent queued edge, edges are
+        # then queued as lists so that they can be updated in place.
+        self._latest = {}
+        self._waiter = None
+        self._callbacks = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @asyncio.coroutine
+    def open(self):
+        """
+        Registers the callbacks feeding the stream, this is done on the
+        first read if not called explicitly.
+        """
+        if self._callbacks is None:
+            self._callbacks = []
+            for gpio in self._gpios:
+                cb = yield from self._pi.add_callback(
+                    gpio, self._edge, self._on_edge, self._extended_tick)
+                self._callbacks.append(cb)
+
+    @asyncio.coroutine
+    def close(self):
+        """Cancels the callbacks feeding the stream."""
+        self._closed = True
+        self._release()
+        self._wakeup()
+        if self._callbacks:
+            for cb in self._callbacks:
+                yield from cb.cancel()
+            self._callbacks = []
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Returns the next (gpio, level, tick) edge, waiting for one if the
+        queue is empty.
+        """
+        if self._callbacks is None:
+            yield from self.open()
+        queue = self._queue
+        while not queue:
+            if self._closed:
+                raise ApigpioError('edge stream closed')
+            self._waiter = asyncio.Future(loop=self._loop)
+            try:
+                yield from self._notify.wait(self._waiter)
+            finally:
+                self._waiter = None
+        event = queue.popleft()
+        if self.overflow == 'coalesce':
+            if self._latest.get(event[0]) is event:
+                del self._latest[event[0]]
+            event = tuple(event)
+        elif self.overflow == 'block' and len(queue) < self.maxsize:
+            self._release()
+        return event
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        if self._closed and not self._queue:
+            raise StopAsyncIteration
+        try:
+            event = yield from self.get()
+        except ApigpioError:
+            if self._closed:
+                raise StopAsyncIteration
+            raise
+        return event
+
+    def _on_edge(self, gpio, level, tick):
+        self.received += 1
+        queue = self._queue
+        if self.overflow == 'coalesce':
+            if len(queue) >= self.maxsize:
+                latest = self._latest.get(gpio)
+                if latest is not None:
+                    latest[1] = level
+                    latest[2] = tick
+                    self.coalesced += 1
+                    return
+                old = queue.popleft()
+                if self._latest.get(old[0]) is old:
+                    del self._latest[old[0]]
+                self.dropped += 1
+            event = [gpio, level, tick]
+            self._latest[gpio] = event
+            queue.append(event)
+        else:
+            if len(queue) >= self.maxsize:
+                if self.overflow == 'drop_oldest':
+                    queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._notify.pause(self)
+            queue.append((gpio, level, tick))
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _release(self):
+        self._notify.resume(self)
+
+
+class _command_channel(object):
+    """
+    A command connection to gpiod.
+
+    pigpiod answers the commands received on a connection in the order they
+    were sent, so a command does not need to wait for the response of the
+    previous one: commands are written as soon as they are submitted and a
+    dedicated reader task matches each 16 bytes response with the oldest
+    pending command.
+
+    Responses are received in a reusable buffer, and the extra data of a
+    response directly in the buffer given with its command.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.s = None
+        self._pending = collections.deque()
+        self._wlock = asyncio.Lock(loop=loop)
+        # reusable receive buffer, holding rbuf[_rstart:_rend]
+        self._rbuf = bytearray(_RX_CHUNK)
+        self._rview = memoryview(self._rbuf)
+        self._rstart = 0
+        self._rend = 0
+        self._reader = None
+        self._broken = False
+        self._recv_into = getattr(loop, 'sock_recv_into', None)
+
+    @property
+    def outstanding(self):
+        """Number of commands sent and still waiting for their response."""
+        return len(self._pending)
+
+    @asyncio.coroutine
+    def connect(self, address):
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setblocking(False)
+        # Disable the Nagle algorithm.
+        self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        yield from self._loop.sock_connect(self.s, address)
+        self._reader = self._loop.create_task(self._read_responses())
+
+    @asyncio.coroutine
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            yield from asyncio.wait([self._reader], loop=self._loop)
+            self._reader = None
+        self._fail_pending(ApigpioError('connection closed'))
+        self.s.close()
+
+    @asyncio.coroutine
+    def command(self, data, rx=False, buf=None):
+        """
+        Sends a packed command and returns its result.
+
+        data:= the packed command, with its extents if any.
+          rx:= True if the response is followed by extra data, the result
+               is then a (res, data) pair.
+         buf:= an optional writable buffer in which the extra data is
+               received, data is then a memoryview on buf.
+        """
+        fut = asyncio.Future(loop=self._loop)
+        yield from self._send(data, ((fut, rx, buf),))
+        return (yield from fut)
+
+    @asyncio.coroutine
+    def commands(self, data, replies):
+        """
+        Sends several packed commands with a single write and returns the
+        list of their results.
+
+           data:= the packed commands.
+        replies:= one (rx, buf) pair for each command in data, see
+                  `command`.
+        """
+        pending = [(asyncio.Future(loop=self._loop), rx, buf)
+                   for rx, buf in replies]
+        yield from self._send(data, pending)
+        results = []
+        for fut, _, _ in pending:
+            results.append((yield from fut))
+        return results
+
+    @asyncio.coroutine
+    def _send(self, data, pending):
+        # Pending commands must be queued in the order they are written on
+        # the socket, which interleaved partial writes would break. Once
+        # started, a write runs to completion even if the caller is
+        # cancelled: a partial command would corrupt the stream.
+        yield from self._wlock.acquire()
+        try:
+            if self._broken or self._reader is None or self._reader.done():
+                raise ApigpioError('not connected')
+            write = asyncio.async(self._loop.sock_sendall(self.s, data),
+                                  loop=self._loop)
+        except BaseException:
+            self._wlock.release()
+            raise
+        self._pending.extend(pending)
+        write.add_done_callback(self._written)
+        # unlike the caller, the write is not cancelled by cancelling the
+        # wait, and its errors are reported through the pending commands.
+        yield from asyncio.wait([write], loop=self._loop)
+
+    def _written(self, write):
+        self._wlock.release()
+        if write.cancelled():
+            exc = ApigpioError('command write cancelled')
+        else:
+            exc = write.exception()
+        if exc is not None:
+            # the commands may have been partially written, the responses
+            # can't be matched with the pending commands anymore.
+            self._broken = True
+            if self._reader is not None:
+                self._reader.cancel()
+            self._fail_pending(exc)
+
+    @asyncio.coroutine
+    def _read_responses(self):
+        rbuf = self._rbuf
+        pending = self._pending
+        try:
+            while True:
+                while self._rend - self._rstart >= _RES_SIZE:
+                    res, = _RES.unpack_from(rbuf, self._rstart + 12)
+                    self._rstart += _RES_SIZE
+                    fut, rx, buf = pending.popleft()
+                    if rx:
+                        count = u2i(res)
+                        data = b''
+                        if count > 0:
+                            data = yield from self._recv_ext(count, buf)
+                        res = (res, data)
+                    if not fut.done():
+                        fut.set_result(res)
+                # keep the start of an incomplete response
+                left = self._rend - self._rstart
+                rbuf[:left] = rbuf[self._rstart:self._rend]
+                self._rstart = 0
+                self._rend = left
+                yield from self._recv(self._limit())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail_pending(e)
+
+    def _limit(self):
+        # Responses are received up to the end of the header of the first
+        # pending command with extra data, which is then received directly
+        # in the buffer of the command. With nothing pending, the next
+        # command may have extra data: only one header is received.
+        limit = 0
+        for _, rx, _ in self._pending:
+            limit += _RES_SIZE
+            if rx or limit >= _RX_CHUNK:
+                break
+        else:
+            limit += _RES_SIZE
+        return min(limit, _RX_CHUNK)
+
+    @asyncio.coroutine
+    def _recv(self, limit):
+        # receives data at the end of the receive buffer, up to limit
+        if self._recv_into is not None:
+            n = yield from self._recv_into(self.s,
+                                           self._rview[self._rend:limit])
+        else:
+            chunk = yield from self._loop.sock_recv(self.s,
+                                                    limit - self._rend)
+            n = len(chunk)
+            self._rbuf[self._rend:self._rend + n] = chunk
+        if not n:
+            raise ApigpioError('connection closed by gpiod')
+        self._rend += n
+
+    @asyncio.coroutine
+    def _recv_ext(self, count, buf=None):
+        """
+        Receives the count bytes of extra data following a response, into
+        buf when it is given and large enough, as bytes otherwise.
+        """
+        view = None
+        if buf is not None:
+            view = memoryview(buf).cast('B')
+            if view.nbytes < count:
+                view = None
+        # data received along with the header, which only happens when the
+        # command was sent while the reader was already receiving.
+        start = self._rstart
+        got = min(count, self._rend - start)
+        self._rstart += got
+
+        if view is None:
+            parts = [bytes(self._rbuf[start:start + got])] if got else []
+            while got < count:
+                chunk = yield from self._loop.sock_recv(self.s, count - got)
+                if not chunk:
+                    raise ApigpioError('connection closed by gpiod')
+                parts.append(chunk)
+                got += len(chunk)
+            return b''.join(parts)
+
+        view = view[:count]
+        view[:got] = self._rview[start:start + got]
+        while got < count:
+            if self._recv_into is not None:
+                n = yield from self._recv_into(self.s, view[got:])
+            else:
+                chunk = yield from self._loop.sock_recv(self.s, count - got)
+                n = len(chunk)
+                view[got:got + n] = chunk
+            if not n:
+                raise ApigpioError('connection closed by gpiod')
+            got += n
+        return view
+
+    def _fail_pending(self, exc):
+        while self._pending:
+            fut, _, _ = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(exc)
+
+
+class _state_cache(object):
+    """
+    Shadow state of the gpios, as set through this client: modes, pull
+    up/down, output levels, PWM dutycycles and servo pulsewidths. None
+    means unknown. The gpios with a glitch or noise filter are kept as a
+    mask, their notified levels are not the levels read.
+
+    Changes are recorded when commands are sent, and forgotten if they
+    fail, so that a command following an identical one still in flight
+    is elided as well.
+    """
+
+    def __init__(self):
+        self.modes = [None] * 54
+        self.puds = [None] * 54
+        self.levels = [None] * 54
+        self.dutycycles = [None] * 54
+        self.pulsewidths = [None] * 54
+        self.filtered = 0
+
+    def is_redundant(self, cmd, p1, p2):
+        """
+        Returns True if the command would not change the state of the
+        gpio.
+        """
+        if cmd == _PI_CMD_WRITE:
+            # a write also stops PWM and servo pulses
+            return self.levels[p1] == p2 and \
+                self.dutycycles[p1] is None and \
+                self.pulsewidths[p1] is None
+        if cmd == _PI_CMD_MODES:
+            return self.modes[p1] == p2
+        if cmd == _PI_CMD_PUD:
+            return self.puds[p1] == p2
+        if cmd == _PI_CMD_PWM:
+            return self.dutycycles[p1] == p2
+        if cmd == _PI_CMD_SERVO:
+            return self.pulsewidths[p1] == p2
+        if cmd in _BANK_CMDS:
+            offset, level = _BANK_CMDS[cmd]
+            levels = self.levels
+            for gpio in _bits(p1, offset):
+                if levels[gpio] != level:
+                    return False
+            return True
+        return False
+
+    def record(self, cmd, p1, p2):
+        """Records the effect of a command."""
+        if cmd == _PI_CMD_WRITE:
+            self.levels[p1] = p2
+            self.modes[p1] = OUTPUT
+            self.dutycycles[p1] = None
+            self.pulsewidths[p1] = None
+        elif cmd == _PI_CMD_MODES:
+            self.forget(p1)
+            self.modes[p1] = p2
+        elif cmd == _PI_CMD_PUD:
+            self.puds[p1] = p2
+        elif cmd == _PI_CMD_PWM:
+            self.dutycycles[p1] = p2
+            self.modes[p1] = OUTPUT
+            self.levels[p1] = None
+            self.pulsewidths[p1] = None
+        elif cmd == _PI_CMD_SERVO:
+            self.pulsewidths[p1] = p2
+            self.modes[p1] = OUTPUT
+            self.levels[p1] = None
+            self.dutycycles[p1] = None
+        elif cmd in _BANK_CMDS:
+            offset, level = _BANK_CMDS[cmd]
+            for gpio in _bits(p1, offset):
+                self.levels[gpio] = level
+        elif cmd in (_PI_CMD_FG, _PI_CMD_FN):
+            if p2:
+                self.filtered |= 1 << p1
+            else:
+                self.filtered &= ~(1 << p1)
+
+    def forget_command(self, cmd, p1):
+        """Forgets the state of the gpios changed by a failed command."""
+        if cmd in _BANK_CMDS:
+            offset, _ = _BANK_CMDS[cmd]
+            for gpio in _bits(p1, offset):
+                self.forget(gpio)
+        elif cmd in (_PI_CMD_WRITE, _PI_CMD_MODES, _PI_CMD_PUD,
+                     _PI_CMD_PWM, _PI_CMD_SERVO):
+            self.forget(p1)
+        elif cmd in (_PI_CMD_FG, _PI_CMD_FN):
+            # the filter may have been set
+            self.filtered |= 1 << p1
+
+    def forget(self, gpio=None):
+        """Forgets the state of a gpio, or of all gpios if None."""
+        if gpio is None:
+            self.__init__()
+            return
+        self.modes[gpio] = None
+        self.puds[gpio] = None
+        self.levels[gpio] = None
+        self.dutycycles[gpio] = None
+        self.pulsewidths[gpio] = None
+
+
+def _bits(bits, offset=0):
+    """Yields the gpios whose bit is set in bits."""
+    while bits:
+        bit = bits & -bits
+        bits ^= bit
+        yield bit.bit_length() - 1 + offset
+
+
+class Batch(object):
+    """
+    A batch of commands sent to gpiod with a single socket write.
+
+    Commands are packed in a buffer, which is preallocated and reused when
+    the batch is executed several times, and are sent together when the
+    batch is executed. The results are returned in the same order as the
+    commands, a failed command giving an ApigpioError instance instead of
+    raising.
+
+    ...
+    b = pi.batch()
+    b.write(17, 1)
+    b.set_servo_pulsewidth(18, 1500)
+    results = yield from b.execute()
+
+    async with pi.batch() as b:
+        b.write(17, 1)
+        b.set_servo_pulsewidth(18, 1500)
+    print(b.results)
+    ...
+    """
+
+    def __init__(self, pi, size=16):
+        """
+        pi:= the Pi instance the commands are sent to.
+        size:= number of commands the buffer is initially sized for.
+        """
+        self._pi = pi
+        self._buf = bytearray(size * _RES_SIZE)
+        self._len = 0
+        # (cmd, p1, p2, decode, start, end) for each command, start and end
+        # delimiting the packed command in the buffer
+        self._entries = []
+        self.results = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, cmd, p1, p2, extents=(), p3=0, decode=_u2i):
+        end = self._len + _RES_SIZE + p3
+        if end > len(self._buf):
+            self._buf.extend(bytes(max(end, 2 * len(self._buf)) -
+                                   len(self._buf)))
+        _CMD.pack_into(self._buf, self._len, cmd, p1, p2, p3)
+        pos = self._len + _RES_SIZE
+        for x in extents:
+            self._buf[pos:pos + len(x)] = x
+            pos += len(x)
+        self._entries.append((cmd, p1, p2, decode, self._len, end))
+        self._len = end
+
+    @asyncio.coroutine
+    def execute(self):
+        """
+        Sends all the commands of the batch and returns the list of their
+        results.
+
+        The batch is emptied and can be filled again afterwards.
+        """
+        entries = self._entries
+        self._entries = []
+        cache = self._pi._cache
+        # whether each command is sent, commands which would not change
+        # the state known by the cache are elided.
+        sent = [True] * len(entries)
+        length = self._len
+        if cache is not None:
+            buf = self._buf
+            length = 0
+            for i, (cmd, p1, p2, _, start, end) in enumerate(entries):
+                if cache.is_redundant(cmd, p1, p2):
+                    sent[i] = False
+                    continue
+                cache.record(cmd, p1, p2)
+                # compacts the buffer over the elided commands
+                if start != length:
+                    buf[length:length + end - start] = buf[start:end]
+                length += end - start
+        self._len = 0
+        replies = [(False, None)] * sent.count(True)
+        responses = []
+        if replies:
+            data = memoryview(self._buf)[:length]
+            try:
+                channel = self._pi._channel_for(None)
+                responses = yield from channel.commands(data, replies)
+            except BaseException:
+                if cache is not None:
+                    for entry, was_sent in zip(entries, sent):
+                        if was_sent:
+                            cache.forget_command(entry[0], entry[1])
+                # the command channel may still be writing from the buffer
+                self._buf = bytearray(len(self._buf))
+                raise
+            finally:
+                data.release()
+        responses = iter(responses)
+        results = []
+        for (cmd, p1, _, decode, _, _), was_sent in zip(entries, sent):
+            if not was_sent:
+                results.append(0)
+                continue
+            res = next(responses)
+            if cache is not None and u2i(res) < 0:
+                cache.forget_command(cmd, p1)
+            if decode is not None:
+                try:
+                    res = decode(res)
+                except ApigpioError as e:
+                    res = e
+            results.append(res)
+        return results
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.results = yield from self.execute()
+        else:
+            # the commands are discarded, nothing was sent
+            self._entries = []
+            self._len = 0
+
+    def set_mode(self, gpio, mode):
+        """See Pi.set_mode."""
+        self._add(_PI_CMD_MODES, gpio, mode)
+
+    def get_mode(self, gpio):
+        """See Pi.get_mode."""
+        self._add(_PI_CMD_MODEG, gpio, 0)
+
+    def set_pull_up_down(self, gpio, pud):
+        """See Pi.set_pull_up_down."""
+        self._add(_PI_CMD_PUD, gpio, pud)
+
+    def write(self, gpio, level):
+        """See Pi.write."""
+        self._add(_PI_CMD_WRITE, gpio, level)
+
+    def read(self, gpio):
+        """See Pi.read."""
+        self._add(_PI_CMD_READ, gpio, 0)
+
+    def read_bank_1(self):
+        """See Pi.read_bank_1."""
+        self._add(_PI_CMD_BR1, 0, 0, decode=None)
+
+    def clear_bank_1(self, bits):
+        """See Pi.clear_bank_1."""
+        self._add(_PI_CMD_BC1, bits, 0)
+
+    def set_bank_1(self, bits):
+        """See Pi.set_bank_1."""
+        self._add(_PI_CMD_BS1, bits, 0)
+
+    def read_bank_2(self):
+        """See Pi.read_bank_2."""
+        self._add(_PI_CMD_BR2, 0, 0, decode=None)
+
+    def clear_bank_2(self, bits):
+        """See Pi.clear_bank_2."""
+        self._add(_PI_CMD_BC2, bits, 0)
+
+    def set_bank_2(self, bits):
+        """See Pi.set_bank_2."""
+        self._add(_PI_CMD_BS2, bits, 0)
+
+    def gpio_trigger(self, user_gpio, pulse_len=10, level=1):
+        """See Pi.gpio_trigger."""
+        self._add(_PI_CMD_TRIG, user_gpio, pulse_len,
+                  [struct.pack("I", level)], 4)
+
+    def set_glitch_filter(self, user_gpio, steady):
+        """See Pi.set_glitch_filter."""
+        self._add(_PI_CMD_FG, user_gpio, steady)
+
+    def set_noise_filter(self, user_gpio, steady, active):
+        """See Pi.set_noise_filter."""
+        self._add(_PI_CMD_FN, user_gpio, steady,
+                  [struct.pack("I", active)], 4)
+
+    def set_PWM_dutycycle(self, user_gpio, dutycycle):
+        """See Pi.set_PWM_dutycycle."""
+        self._add(_PI_CMD_PWM, user_gpio, int(dutycycle))
+
+    def set_servo_pulsewidth(self, user_gpio, pulsewidth):
+        """See Pi.set_servo_pulsewidth."""
+        self._add(_PI_CMD_SERVO, user_gpio, int(pulsewidth))
+
+    def set_watchdog(self, user_gpio, wdog_timeout):
+        """See Pi.set_watchdog."""
+        self._add(_PI_CMD_WDOG, user_gpio, int(wdog_timeout))
+
 
 class Pi(object):
 
@@ -519,56 +1535,158 @@ class Pi(object):
         """
         Runs a pigpio socket command.
 
-        sl:= command socket and lock.
         cmd:= the command to be executed.
         p1:= command parameter 1 (if applicable).
          p2:=  command parameter 2 (if applicable).
         """
-        with (yield from self._lock):
-            data = struct.pack('IIII', cmd, p1, p2, 0)
-            self._loop.sock_sendall(self.s, data)
-            response = yield from self._loop.sock_recv(self.s, 16)
-            _, res = struct.unpack('12sI', response)
-            return res
+        channel = self._channel_for(cmd)
+        res = yield from channel.command(_CMD.pack(cmd, p1, p2, 0))
+        return res
 
     @asyncio.coroutine
     def _pigpio_aio_command_ext(self, cmd, p1, p2, p3, extents, rl=True):
         """
         Runs an extended pigpio socket command.
 
-            sl:= command socket and lock.
            cmd:= the command to be executed.
             p1:= command parameter 1 (if applicable).
             p2:= command parameter 2 (if applicable).
             p3:= total size in bytes of following extents
         extents:= additional data blocks
         """
-        with (yield from self._lock):
-            ext = bytearray(struct.pack('IIII', cmd, p1, p2, p3))
-            for x in extents:
-                if isinstance(x, str):
-                    ext.extend(_b(x))
-                else:
-                    ext.extend(x)
-            self._loop.sock_sendall(self.s, ext)
-            response = yield from self._loop.sock_recv(self.s, 16)
-            _, res = struct.unpack('12sI', response)
+        ext = self._pack_ext(cmd, p1, p2, p3, extents)
+        res = yield from self._channel_for(cmd).command(ext)
+        return res
+
+    @asyncio.coroutine
+    def _pigpio_aio_command_rx(self, cmd, p1, p2, p3=0, extents=(),
+                               buf=None):
+        """
+        Runs a pigpio socket command whose response is followed by extra
+        data, the size of which is given by the command result.
+
+           cmd:= the command to be executed.
+            p1:= command parameter 1 (if applicable).
+            p2:= command parameter 2 (if applicable).
+            p3:= total size in bytes of following extents
+        extents:= additional data blocks
+           buf:= optional writable buffer the extra data is received in.
+
+        Returns a (res, data) pair, data is empty when res <= 0.
+        """
+        ext = self._pack_ext(cmd, p1, p2, p3, extents)
+        res = yield from self._channel_for(cmd).command(ext, True, buf)
+        return res
+
+    @asyncio.coroutine
+    def _cached_command(self, cmd, p1, p2):
+        """
+        Runs a pigpio socket command changing the state of gpios, which is
+        elided when the state cache is enabled and knows it would not
+        change anything.
+        """
+        cache = self._cache
+        if cache is None:
+            res = yield from self._pigpio_aio_command(cmd, p1, p2)
             return res
+        if cache.is_redundant(cmd, p1, p2):
+            return 0
+        cache.record(cmd, p1, p2)
+        try:
+            res = yield from self._pigpio_aio_command(cmd, p1, p2)
+        except Exception:
+            cache.forget_command(cmd, p1)
+            raise
+        if u2i(res) < 0:
+            cache.forget_command(cmd, p1)
+        return res
+
+    def _channel_for(self, cmd):
+        """
+        Returns the connection a command is sent on: the bulk connection
+        for bulk commands, when there is one, otherwise the command
+        connection with the fewest pending commands.
+        """
+        if self._bulk is not None and cmd in _BULK_CMDS:
+            return self._bulk
+        channels = self._channels
+        if len(channels) == 1:
+            return channels[0]
+        return min(channels, key=lambda c: c.outstanding)
+
+    @staticmethod
+    def _pack_ext(cmd, p1, p2, p3, extents):
+        ext = bytearray(_CMD.pack(cmd, p1, p2, p3))
+        for x in extents:
+            if isinstance(x, str):
+                ext.extend(_b(x))
+            else:
+                ext.extend(x)
+        return ext
+
+    def batch(self, size=16):
+        """
+        Returns a new, empty, Batch of commands for this Pi.
+
+        size:= number of commands the batch buffer is initially sized for.
+
+        ...
+        async with pi.batch() as b:
+            for gpio in leds:
+                b.write(gpio, 1)
+        ...
+        """
+        return Batch(self, size)
 
     @asyncio.coroutine
-    def connect(self, address):
+    def execute_many(self, commands):
+        """
+        Runs several commands with a single socket write and returns the
+        list of their results, in the same order. Failed commands give an
+        ApigpioError instance instead of raising.
+
+        commands:= an iterable of (name, arg, ...) tuples, where name is
+                   the name of a Batch method.
+
+        ...
+        res = yield from pi.execute_many([('write', 17, 1),
+                                          ('set_servo_pulsewidth', 18, 1500)])
+        ...
+        """
+        b = Batch(self)
+        for name, *args in commands:
+            getattr(b, name)(*args)
+        results = yield from b.execute()
+        return results
+
+    @asyncio.coroutine
+    def connect(self, address, connections=1, bulk_lane=False):
         """
         Connect to a remote or local gpiod daemon.
         :param address: a pair (address, port), the address must be already
         resolved (for example an ip address)
+        :param connections: number of command connections opened to gpiod,
+        each command is sent on the connection with the fewest pending
+        commands. Commands which are not awaited one after the other may
+        then be executed in any order.
+        :param bulk_lane: if True, an additional connection is opened and
+        dedicated to commands transferring large amounts of data (script
+        upload, waveforms, I2C/SPI/serial transfers), so that they never
+        delay the other commands.
         :return:
         """
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.setblocking(False)
-        # Disable the Nagle algorithm.
-        self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-
-        yield from self._loop.sock_connect(self.s, address)
+        if connections < 1:
+            raise ValueError('connections must be at least 1')
+        self._channels = []
+        for _ in range(connections):
+            channel = _command_channel(self._loop)
+            yield from channel.connect(address)
+            self._channels.append(channel)
+        self._channel = self._channels[0]
+        self.s = self._channel.s
+        if bulk_lane:
+            self._bulk = _command_channel(self._loop)
+            yield from self._bulk.connect(address)
 
         yield from self._notify._connect(address)
 
@@ -581,7 +1699,10 @@ class Pi(object):
         print('closing notifier')
         yield from self._notify.close()
         print('closing socket')
-        self.s.close()
+        for channel in self._channels:
+            yield from channel.close()
+        if self._bulk is not None:
+            yield from self._bulk.close()
 
     @asyncio.coroutine
     def get_version(self):
@@ -681,18 +1802,11 @@ class Pi(object):
         (s, pars) = pi.script_status(sid)
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_PROCP, script_id, 0)
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_PROCP,
+                                                           script_id, 0)
         bytes = u2i(res)
 
         if bytes > 0:
-
-            # Fixme : this sould be the same a _rxbuf
-            # data = self._rxbuf(bytes)
-            data = yield from self._loop.sock_recv(self.s, bytes)
-            while len(data) < bytes:
-                b = yield from self._loop.sock_recv(self.s, bytes-len(data))
-                data.extend(b)
-
             pars = struct.unpack('11i', _str(data))
             status = pars[0]
             params = pars[1:]
@@ -760,7 +1874,7 @@ class Pi(object):
         pi.clear_bank_1(int("111110010000",2))
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_BC1, bits, 0)
+        res = yield from self._cached_command(_PI_CMD_BC1, bits, 0)
         return _u2i(res)
 
     @asyncio.coroutine
@@ -778,25 +1892,144 @@ class Pi(object):
         pi.set_bank_1(int("111110010000",2))
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_BS1, bits, 0)
+        res = yield from self._cached_command(_PI_CMD_BS1, bits, 0)
         return _u2i(res)
 
     @asyncio.coroutine
-    def set_mode(self, gpio, mode):
+    def read_bank_2(self):
         """
-        Sets the gpio mode.
+        Returns the levels of the bank 2 gpios (gpios 32-53).
 
-        gpio:= 0-53.
-        mode:= INPUT, OUTPUT, ALT0, ALT1, ALT2, ALT3, ALT4, ALT5.
+        The returned 32 bit integer has a bit set if the corresponding
+        gpio is high.  Gpio n has bit value (1<<(n-32)).
 
         ...
-        pi.set_mode( 4, apigpio.INPUT)  # gpio  4 as input
-        pi.set_mode(17, apigpio.OUTPUT) # gpio 17 as output
-        pi.set_mode(24, apigpio.ALT2)   # gpio 24 as ALT2
+        print(bin(pi.read_bank_2()))
+        0b1111110000000000000000
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_MODES, gpio, mode)
-        return _u2i(res)
+        res = yield from self._pigpio_aio_command(_PI_CMD_BR2, 0, 0)
+        return res
+
+    @asyncio.coroutine
+    def clear_bank_2(self, bits):
+        """
+        Clears gpios 32-53 if the corresponding bit (0-21) in bits is set.
+
+        bits:= a 32 bit mask with 1 set if the corresponding gpio is
+             to be cleared.
+
+        A returned status of PI_SOME_PERMITTED indicates that the user
+        is not allowed to write to one or more of the gpios.
+
+        ...
+        pi.clear_bank_2(0x1010)
+        ...
+        """
+        res = yield from self._cached_command(_PI_CMD_BC2, bits, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def set_bank_2(self, bits):
+        """
+        Sets gpios 32-53 if the corresponding bit (0-21) in bits is set.
+
+        bits:= a 32 bit mask with 1 set if the corresponding gpio is
+             to be set.
+
+        A returned status of PI_SOME_PERMITTED indicates that the user
+        is not allowed to write to one or more of the gpios.
+
+        ...
+        pi.set_bank_2(0x303)
+        ...
+        """
+        res = yield from self._cached_command(_PI_CMD_BS2, bits, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def write_many(self, levels):
+        """
+        Sets the level of several gpios at once.
+
+        levels:= a dict mapping gpios (0-53) to levels (0, 1).
+
+        The levels are written with at most one set and one clear command
+        per bank, sent together, whatever the number of gpios.
+
+        ...
+        yield from pi.write_many({17: 1, 18: 0, 40: 1})
+        ...
+        """
+        set_bits = [0, 0]
+        clear_bits = [0, 0]
+        for gpio, level in levels.items():
+            bank, bit = divmod(gpio, 32)
+            if level:
+                set_bits[bank] |= 1 << bit
+            else:
+                clear_bits[bank] |= 1 << bit
+        b = Batch(self, 4)
+        if set_bits[0]:
+            b.set_bank_1(set_bits[0])
+        if clear_bits[0]:
+            b.clear_bank_1(clear_bits[0])
+        if set_bits[1]:
+            b.set_bank_2(set_bits[1])
+        if clear_bits[1]:
+            b.clear_bank_2(clear_bits[1])
+        results = yield from b.execute()
+        for res in results:
+            if isinstance(res, ApigpioError):
+                raise res
+        return 0
+
+    @asyncio.coroutine
+    def read_many(self, gpios):
+        """
+        Returns the levels of several gpios, as a dict mapping each gpio to
+        its level.
+
+        gpios:= the gpios (0-53) to read.
+
+        The levels are read with at most one read command per bank, sent
+        together.
+
+        ...
+        levels = yield from pi.read_many([4, 17, 40])
+        ...
+        """
+        gpios = list(gpios)
+        banks = set(gpio // 32 for gpio in gpios)
+        b = Batch(self, 2)
+        if 0 in banks:
+            b.read_bank_1()
+        if 1 in banks:
+            b.read_bank_2()
+        results = yield from b.execute()
+        levels = {}
+        for bank in (0, 1):
+            if bank in banks:
+                levels[bank] = results.pop(0)
+        return {gpio: (levels[gpio // 32] >> (gpio % 32)) & 1
+                for gpio in gpios}
+
+    @asyncio.coroutine
+    def set_mode(self, gpio, mode):
+        """
+        Sets the gpio mode.
+
+        gpio:= 0-53.
+        mode:= INPUT, OUTPUT, ALT0, ALT1, ALT2, ALT3, ALT4, ALT5.
+
+        ...
+        pi.set_mode( 4, apigpio.INPUT)  # gpio  4 as input
+        pi.set_mode(17, apigpio.OUTPUT) # gpio 17 as output
+        pi.set_mode(24, apigpio.ALT2)   # gpio 24 as ALT2
+        ...
+        """
+        res = yield from self._cached_command(_PI_CMD_MODES, gpio, mode)
+        return _u2i(res)
 
     @asyncio.coroutine
     def set_pull_up_down(self, gpio, pud):
@@ -810,7 +2043,7 @@ class Pi(object):
         yield from pi.set_pull_up_down(24, apigpio.PUD_DOWN)
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_PUD, gpio, pud)
+        res = yield from self._cached_command(_PI_CMD_PUD, gpio, pud)
         return _u2i(res)
 
     @asyncio.coroutine
@@ -838,8 +2071,13 @@ class Pi(object):
         4
         ...
         """
+        if self._cache is not None and self._cache.modes[gpio] is not None:
+            return self._cache.modes[gpio]
         res = yield from self._pigpio_aio_command(_PI_CMD_MODEG, gpio, 0)
-        return _u2i(res)
+        res = _u2i(res)
+        if self._cache is not None and res >= 0:
+            self._cache.modes[gpio] = res
+        return res
 
     @asyncio.coroutine
     def write(self, gpio, level):
@@ -864,7 +2102,7 @@ class Pi(object):
         1
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_WRITE, gpio, level)
+        res = yield from self._cached_command(_PI_CMD_WRITE, gpio, level)
         return _u2i(res)
 
     @asyncio.coroutine
@@ -882,6 +2120,19 @@ class Pi(object):
         1
         ...
         """
+        cache = self._cache
+        if cache is not None:
+            level = None
+            mode = cache.modes[gpio]
+            if mode == OUTPUT:
+                level = cache.levels[gpio]
+            elif mode == INPUT and not (gpio < 32 and
+                                        cache.filtered & (1 << gpio)):
+                # levels of monitored inputs are kept current by
+                # notifications, which are delayed by filters
+                level = self._notify.level(gpio)
+            if level is not None:
+                return level
         res = yield from self._pigpio_aio_command(_PI_CMD_READ, gpio, 0)
         return _u2i(res)
 
@@ -931,7 +2182,10 @@ class Pi(object):
         ...
         """
         res = yield from self._pigpio_aio_command(_PI_CMD_FG, user_gpio, steady)
-        return _u2i(res)
+        res = _u2i(res)
+        if self._cache is not None:
+            self._cache.record(_PI_CMD_FG, user_gpio, steady)
+        return res
 
     @asyncio.coroutine
     def set_noise_filter(self, user_gpio, steady, active):
@@ -966,7 +2220,10 @@ class Pi(object):
         extents = [struct.pack("I", active)]
         res = yield from self._pigpio_aio_command_ext(_PI_CMD_FN, user_gpio,
                                                       steady, 4, extents)
-        return _u2i(res)
+        res = _u2i(res)
+        if self._cache is not None:
+            self._cache.record(_PI_CMD_FN, user_gpio, steady)
+        return res
 
     @asyncio.coroutine
     def set_PWM_dutycycle(self, user_gpio, dutycycle):
@@ -983,11 +2240,415 @@ class Pi(object):
         pi.set_PWM_dutycycle(4, 255) # PWM full on
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_PWM, user_gpio, int(dutycycle))
+        res = yield from self._cached_command(_PI_CMD_PWM, user_gpio,
+                                              int(dutycycle))
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def get_PWM_dutycycle(self, user_gpio):
+        """
+        Returns the PWM dutycycle being used on the GPIO.
+
+        user_gpio:= 0-31.
+
+        For normal PWM the dutycycle will be out of the defined range
+        for the GPIO (see [*get_PWM_range*]).
+
+        If a hardware clock is active on the GPIO the reported
+        dutycycle will be 500000 (500k) out of 1000000 (1M).
+
+        If hardware PWM is active on the GPIO the reported dutycycle
+        will be out of a 1000000 (1M).
+
+        ...
+        yield from pi.set_PWM_dutycycle(4, 25)
+        print((yield from pi.get_PWM_dutycycle(4)))
+        25
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_GDC, user_gpio, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def set_PWM_range(self, user_gpio, range_):
+        """
+        Sets the range of PWM values to be used on the GPIO.
+
+        user_gpio:= 0-31.
+           range_:= 25-40000.
+
+        If PWM is currently active on the GPIO its dutycycle will be
+        scaled to reflect the new range.
+
+        Returns the real range for the given GPIO's frequency.
+
+        ...
+        yield from pi.set_PWM_range(9, 100)  # now  25 1/4,  50 1/2,  75 3/4 on
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_PRS, user_gpio,
+                                                  range_)
+        res = _u2i(res)
+        if res >= 0:
+            self._pwm_ranges[user_gpio] = range_
+            if self._cache is not None:
+                # the dutycycle has been scaled by gpiod
+                self._cache.dutycycles[user_gpio] = None
+        return res
+
+    @asyncio.coroutine
+    def get_PWM_range(self, user_gpio):
+        """
+        Returns the range of PWM values being used on the GPIO.
+
+        user_gpio:= 0-31.
+
+        If a hardware clock or hardware PWM is active on the GPIO
+        the reported range will be 1000000 (1M).
+
+        ...
+        yield from pi.set_PWM_range(9, 500)
+        print((yield from pi.get_PWM_range(9)))
+        500
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_PRG, user_gpio, 0)
+        res = _u2i(res)
+        if res >= 0:
+            self._pwm_ranges[user_gpio] = res
+        return res
+
+    @asyncio.coroutine
+    def get_PWM_real_range(self, user_gpio):
+        """
+        Returns the real (underlying) range of PWM values being
+        used on the GPIO.
+
+        user_gpio:= 0-31.
+
+        If a hardware clock is active on the GPIO the reported
+        real range will be 1000000 (1M).
+
+        If hardware PWM is active on the GPIO the reported real range
+        will be approximately 250M divided by the set PWM frequency.
+
+        ...
+        yield from pi.set_PWM_frequency(4, 800)
+        print((yield from pi.get_PWM_real_range(4)))
+        250
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_PRRG, user_gpio, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def set_PWM_frequency(self, user_gpio, frequency):
+        """
+        Sets the frequency (in Hz) of the PWM to be used on the GPIO.
+
+        user_gpio:= 0-31.
+        frequency:= >=0 Hz
+
+        Returns the numerically closest frequency if OK.
+
+        If PWM is currently active on the GPIO it will be switched
+        off and then back on at the new frequency.
+
+        Each GPIO can be independently set to one of 18 different
+        PWM frequencies.
+
+        ...
+        yield from pi.set_PWM_frequency(4, 0)
+        print((yield from pi.get_PWM_frequency(4)))
+        10
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_PFS, user_gpio,
+                                                  frequency)
+        res = _u2i(res)
+        if res >= 0:
+            self._pwm_frequencies[user_gpio] = res
+        return res
+
+    @asyncio.coroutine
+    def get_PWM_frequency(self, user_gpio):
+        """
+        Returns the frequency of PWM being used on the GPIO.
+
+        user_gpio:= 0-31.
+
+        Returns the frequency (in Hz) used for the GPIO.
+
+        For normal PWM the frequency will be that defined for the GPIO
+        by [*set_PWM_frequency*].
+
+        If a hardware clock is active on the GPIO the reported frequency
+        will be that set by [*hardware_clock*].
+
+        If hardware PWM is active on the GPIO the reported frequency
+        will be that set by [*hardware_PWM*].
+
+        The frequency of software PWM is kept by this client, so that
+        it is only queried once.
+
+        ...
+        yield from pi.set_PWM_frequency(4,0)
+        print((yield from pi.get_PWM_frequency(4)))
+        10
+        ...
+        """
+        freq = self._pwm_frequencies.get(user_gpio)
+        if freq is not None:
+            return freq
+        res = yield from self._pigpio_aio_command(_PI_CMD_PFG, user_gpio, 0)
+        res = _u2i(res)
+        if res >= 0:
+            self._pwm_frequencies[user_gpio] = res
+        return res
+
+    @asyncio.coroutine
+    def set_PWM_fraction(self, user_gpio, fraction):
+        """
+        Starts (non-zero fraction) or stops (0.0) PWM pulses on the GPIO,
+        with a dutycycle given as a fraction of the PWM range.
+
+        user_gpio:= 0-31.
+         fraction:= 0.0-1.0.
+
+        The range of the GPIO is kept by this client: it is only queried
+        from gpiod if it was not set or read through this Pi.
+
+        ...
+        yield from pi.set_PWM_fraction(4, 0.25) # PWM 1/4 on
+        ...
+        """
+        range_ = yield from self._PWM_range(user_gpio)
+        fraction = min(max(fraction, 0.0), 1.0)
+        res = yield from self.set_PWM_dutycycle(user_gpio,
+                                                round(fraction * range_))
+        return res
+
+    @asyncio.coroutine
+    def get_PWM_fraction(self, user_gpio):
+        """
+        Returns the PWM dutycycle being used on the GPIO as a fraction
+        (0.0-1.0) of its PWM range.
+
+        user_gpio:= 0-31.
+        """
+        range_ = yield from self._PWM_range(user_gpio)
+        dutycycle = yield from self.get_PWM_dutycycle(user_gpio)
+        return dutycycle / range_
+
+    @asyncio.coroutine
+    def _PWM_range(self, user_gpio):
+        range_ = self._pwm_ranges.get(user_gpio)
+        if range_ is None:
+            range_ = yield from self.get_PWM_range(user_gpio)
+        return range_
+
+    @asyncio.coroutine
+    def get_servo_pulsewidth(self, user_gpio):
+        """
+        Returns the servo pulsewidth being used on the GPIO.
+
+        user_gpio:= 0-31.
+
+        Returns the servo pulsewidth.
+
+        ...
+        yield from pi.set_servo_pulsewidth(4, 525)
+        print((yield from pi.get_servo_pulsewidth(4)))
+        525
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_GPW, user_gpio, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def hardware_clock(self, gpio, clkfreq):
+        """
+        Starts a hardware clock on a GPIO at the specified frequency.
+        Frequencies above 30MHz are unlikely to work.
+
+           gpio:= see description
+        clkfreq:= 0 (off) or 4689-250000000 (250M)
+
+        Returns 0 if OK, otherwise PI_NOT_PERMITTED, PI_BAD_GPIO,
+        PI_NOT_HCLK_GPIO, PI_BAD_HCLK_FREQ,or PI_BAD_HCLK_PASS.
+
+        The same clock is available on multiple GPIO. The latest
+        frequency setting will be used by all GPIO which share a clock.
+
+        The GPIO must be one of the following:
+
+        . .
+        4   clock 0  All models
+        5   clock 1  All models but A and B (reserved for system use)
+        6   clock 2  All models but A and B
+        20  clock 0  All models but A and B
+        21  clock 0  All models but A and Rev.2 B
+        32  clock 0  Compute module only
+        34  clock 0  Compute module only
+        42  clock 1  Compute module only (reserved for system use)
+        43  clock 2  Compute module only
+        44  clock 1  Compute module only (reserved for system use)
+        . .
+
+        ...
+        yield from pi.hardware_clock(4, 5000) # 5 KHz clock on GPIO 4
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_HC, gpio, clkfreq)
+        # the gpio is switched to its clock alternative function
+        self.invalidate_cache(gpio)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def hardware_PWM(self, gpio, PWMfreq, PWMduty):
+        """
+        Starts hardware PWM on a GPIO at the specified frequency
+        and dutycycle. Frequencies above 30MHz are unlikely to work.
+
+           gpio:= see descripton
+        PWMfreq:= 0 (off) or 1-125000000 (125M).
+        PWMduty:= 0 (off) to 1000000 (1M)(fully on).
+
+        Returns 0 if OK, otherwise PI_NOT_PERMITTED, PI_BAD_GPIO,
+        PI_NOT_HPWM_GPIO, PI_BAD_HPWM_DUTY, PI_BAD_HPWM_FREQ.
+
+        The same PWM channel is available on multiple GPIO.
+        The latest frequency and dutycycle setting will be used
+        by all GPIO which share a PWM channel.
+
+        The GPIO must be one of the following:
+
+        . .
+        12  PWM channel 0  All models but A and B
+        13  PWM channel 1  All models but A and B
+        18  PWM channel 0  All models
+        19  PWM channel 1  All models but A and B
+
+        40  PWM channel 0  Compute module only
+        41  PWM channel 1  Compute module only
+        45  PWM channel 1  Compute module only
+        52  PWM channel 0  Compute module only
+        53  PWM channel 1  Compute module only
+        . .
+
+        ...
+        yield from pi.hardware_PWM(18, 800, 250000) # 800Hz 25% dutycycle
+        ...
+        """
+        # I p1 gpio
+        # I p2 PWMfreq
+        # I p3 4
+        # (optional) extension
+        # I PWMdutycycle
+        extents = [struct.pack('I', PWMduty)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_HP, gpio,
+                                                      PWMfreq, 4, extents)
+        # the gpio is switched to its PWM alternative function
+        self.invalidate_cache(gpio)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def ramp(self, user_gpio, target, duration, servo=False, curve=None,
+             start=None):
+        """
+        Ramps the PWM dutycycle (or the servo pulsewidth) of a gpio to
+        target over duration seconds, and returns once the target is set.
+
+        user_gpio:= 0-31.
+           target:= the final dutycycle (or pulsewidth).
+         duration:= the duration of the ramp, in seconds.
+            servo:= True to ramp the servo pulsewidth.
+            curve:= the easing function of the ramp, linear by default,
+                    see apigpio.ramp.
+            start:= the starting value, by default the current one.
+
+        All the ramps of the Pi share a single timer and their updates are
+        sent together, see apigpio.ramp.Ramper.
+
+        ...
+        yield from asyncio.gather(pi.ramp(4, 255, 2.0),
+                                  pi.ramp(17, 2000, 1.0, servo=True))
+        ...
+        """
+        from .ramp import Ramper, linear
+        if self._ramper is None:
+            self._ramper = Ramper(self)
+        yield from self._ramper.ramp(user_gpio, target, duration, servo,
+                                     curve or linear, start)
+
+    @asyncio.coroutine
+    def set_watchdog(self, user_gpio, wdog_timeout):
+        """
+        Sets a watchdog timeout for a GPIO.
+
+           user_gpio:= 0-31.
+        wdog_timeout:= 0-60000 milliseconds, 0 cancels the watchdog.
+
+        The watchdog is nominally in milliseconds.
+
+        Only one watchdog may be registered per GPIO.
+
+        The watchdog may be cancelled by setting timeout to 0.
+
+        Once a watchdog has been started, the callbacks of the GPIO are
+        called with level TIMEOUT whenever no level change has been
+        detected for the timeout, see add_callback.
+
+        ...
+        yield from pi.set_watchdog(23, 1000) # 1000 ms watchdog on GPIO 23
+        yield from pi.set_watchdog(23, 0)    # cancel watchdog on GPIO 23
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WDOG, user_gpio,
+                                                  int(wdog_timeout))
         return _u2i(res)
 
     @asyncio.coroutine
-    def add_callback(self, user_gpio, edge=RISING_EDGE, func=None):
+    def wait_for_edge(self, user_gpio, edge=RISING_EDGE, wait_timeout=60.0):
+        """
+        Wait for an edge event on a gpio.
+
+           user_gpio:= 0-31.
+                edge:= EITHER_EDGE, RISING_EDGE (default), or
+                       FALLING_EDGE.
+        wait_timeout:= >=0.0 (default 60.0).
+
+        The function returns when the edge is detected or after
+        the number of seconds specified by timeout has expired.
+
+        Returns True if the edge was detected, otherwise False.
+
+        ...
+        if (yield from pi.wait_for_edge(23)):
+            print("Rising edge detected")
+        else:
+            print("wait for edge timed out")
+        ...
+        """
+        detected = asyncio.Future(loop=self._loop)
+
+        def on_edge(gpio, level, tick):
+            if level != TIMEOUT and not detected.done():
+                detected.set_result(True)
+
+        cb = yield from self.add_callback(user_gpio, edge, on_edge)
+        try:
+            yield from asyncio.wait_for(self._notify.wait(detected),
+                                        wait_timeout, loop=self._loop)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            yield from cb.cancel()
+
+    @asyncio.coroutine
+    def add_callback(self, user_gpio, edge=RISING_EDGE, func=None,
+                     extended_tick=False):
         """
         Calls a user supplied function (a callback) whenever the
         specified gpio edge is detected.
@@ -995,9 +2656,26 @@ class Pi(object):
         user_gpio:= 0-31.
            edge:= EITHER_EDGE, RISING_EDGE (default), or FALLING_EDGE.
            func:= user supplied callback function.
+  extended_tick:= if True, the callback receives a 64 bit tick instead
+                  of the 32 bit tick.
 
         The user supplied callback receives three parameters, the gpio,
-        the level, and the tick.
+        the level, and the tick. The level is 0 (change to low), 1 (change
+        to high) or TIMEOUT (no level change during the watchdog timeout,
+        see set_watchdog).
+
+        The 32 bit tick is the number of microseconds since the system
+        boot and wraps around about every 72 minutes. The extended tick is
+        monotonic, see also host_time_ns.
+
+        The callback may also be a coroutine function, it is then run in
+        its own task so that it can use the Pi (e.g. to write a gpio)
+        without blocking the reception of notifications. Calls of a given
+        coroutine callback are run one after the other, in the order of
+        the edges, and the number of coroutine callbacks running at the
+        same time is limited by the callback_concurrency given to the Pi.
+        If a coroutine callback falls behind by more than callback_queue
+        calls, the oldest ones are dropped and counted in cb.dropped().
 
         If a user callback is not specified a default tally callback is
         provided which simply counts edges.  The count may be retrieved
@@ -1024,25 +2702,116 @@ class Pi(object):
         ...
         """
 
-        cb = Callback(self._notify, user_gpio, edge, func)
+        cb = Callback(self._notify, user_gpio, edge, func, extended_tick)
         yield from self._notify.append(cb)
 
         return cb
 
-    @asyncio.coroutine
-    def set_servo_pulsewidth(self, user_gpio, pulsewidth):
+    def edges(self, gpios, edge=EITHER_EDGE, maxsize=1024,
+              overflow='drop_oldest', extended_tick=False):
         """
-        Starts (500-2500) or stops (0) servo pulses on the GPIO.
-         user_gpio:= 0-31.
-        pulsewidth:= 0 (off),
-                     500 (most anti-clockwise) - 2500 (most clockwise).
-        The selected pulsewidth will continue to be transmitted until
-        changed by a subsequent call to set_servo_pulsewidth.
-        The pulsewidths supported by servos varies and should probably
-        be determined by experiment. A value of 1500 should always be
-        safe and represents the mid-point of rotation.
-        You can DAMAGE a servo if you command it to move beyond its
-        limits.
+        Returns an EdgeStream, an asynchronous iterator over the edges
+        detected on the gpios.
+
+          gpios:= the user gpios (0-31) to monitor.
+           edge:= EITHER_EDGE (default), RISING_EDGE, or FALLING_EDGE.
+        maxsize:= maximum number of edges queued.
+       overflow:= 'drop_oldest' (default), 'coalesce' or 'block', what
+                  happens to new edges when the queue is full.
+  extended_tick:= if True, edges hold 64 bit ticks.
+
+        ...
+        stream = pi.edges([18, 23], apigpio.EITHER_EDGE, maxsize=256)
+        async for gpio, level, tick in stream:
+            print(gpio, level, tick)
+        print(stream.dropped)
+        ...
+        """
+        return EdgeStream(self, gpios, edge, maxsize, overflow,
+                          extended_tick)
+
+    def host_time_ns(self, extended_tick):
+        """
+        Returns the host time, in time.monotonic_ns() nanoseconds,
+        corresponding to an extended tick.
+
+        The reference is taken when connecting, call sync_clock to take a
+        new one if the drift between the two clocks matters.
+        """
+        return self._notify.host_time_ns(extended_tick)
+
+    @asyncio.coroutine
+    def sync_clock(self):
+        """
+        Takes a new reference for the conversion of extended ticks to host
+        time.
+        """
+        yield from self._notify.sync_clock()
+
+    def capture(self, gpios, size=65536):
+        """
+        Returns a Capture, which records the raw notification reports in a
+        NumPy ring buffer for signal analysis. Requires numpy.
+
+        gpios:= the user gpios (0-31) whose changes must be reported.
+         size:= number of reports kept in the ring buffer.
+
+        ...
+        cap = pi.capture([18])
+        yield from cap.start()
+        yield from asyncio.sleep(1)
+        ticks, levels = apigpio.capture.gpio_edges(cap.window(500000), 18)
+        ...
+        """
+        from .capture import Capture
+        return Capture(self, gpios, size)
+
+    def invalidate_cache(self, gpio=None):
+        """
+        Forgets the cached state of a gpio, or of all gpios if None, for
+        example when it may have been changed by another client. This
+        includes the PWM range and frequency.
+        """
+        if self._cache is not None:
+            self._cache.forget(gpio)
+        if gpio is None:
+            self._pwm_ranges.clear()
+            self._pwm_frequencies.clear()
+        else:
+            self._pwm_ranges.pop(gpio, None)
+            self._pwm_frequencies.pop(gpio, None)
+
+    def set_callback_error_handler(self, handler):
+        """
+        Sets the function called when a callback raises an exception.
+
+        handler:= a function taking two arguments (func, exception), func
+                  being the callback which raised. None restores the
+                  default handler, which logs the exception.
+
+        ...
+        def on_error(func, exc):
+            errors.append(exc)
+
+        pi.set_callback_error_handler(on_error)
+        ...
+        """
+        self._notify.error_handler = handler
+
+    @asyncio.coroutine
+    def set_servo_pulsewidth(self, user_gpio, pulsewidth):
+        """
+        Starts (500-2500) or stops (0) servo pulses on the GPIO.
+         user_gpio:= 0-31.
+        pulsewidth:= 0 (off),
+                     500 (most anti-clockwise) - 2500 (most clockwise).
+        The selected pulsewidth will continue to be transmitted until
+        changed by a subsequent call to set_servo_pulsewidth.
+        The pulsewidths supported by servos varies and should probably
+        be determined by experiment. A value of 1500 should always be
+        safe and represents the mid-point of rotation.
+        You can DAMAGE a servo if you command it to move beyond its
+        limits.
         ...
         yield from pi.set_servo_pulsewidth(17, 0)    # off
         yield from pi.set_servo_pulsewidth(17, 1000) # safe anti-clockwise
@@ -1050,13 +2819,1282 @@ class Pi(object):
         yield from pi.set_servo_pulsewidth(17, 2000) # safe clockwise
         ...
         """
-        res = yield from self._pigpio_aio_command(_PI_CMD_SERVO, user_gpio, int(pulsewidth))
+        res = yield from self._cached_command(_PI_CMD_SERVO, user_gpio,
+                                              int(pulsewidth))
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_clear(self):
+        """
+        Clears all waveforms and any data added by calls to the
+        wave_add_* functions.
+
+        ...
+        yield from pi.wave_clear()
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVCLR, 0, 0)
+        self._wave_cache.clear()
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_add_new(self):
+        """
+        Starts a new empty waveform.
+
+        You would not normally need to call this function as it is
+        automatically called after a waveform is created with the
+        wave_create function.
+
+        ...
+        yield from pi.wave_add_new()
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVNEW, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_add_generic(self, pulses):
+        """
+        Adds a list of pulses to the current waveform.
+
+        pulses:= the pulses: a WaveBuilder, a flattened array('I'), a NumPy
+                 array of (gpio_on, gpio_off, delay) rows or an iterable of
+                 Pulse, see apigpio.wave.pack_pulses.
+
+        Returns the new total number of pulses in the current waveform.
+
+        The pulses are sent to gpiod in a single command, arrays are sent
+        as they are.
+
+        ...
+        w = apigpio.wave.WaveBuilder()
+        w.set(4, 100).clear(4, 100)
+        yield from pi.wave_add_generic(w)
+
+        yield from pi.wave_add_generic([Pulse(1<<4, 0, 100),
+                                        Pulse(0, 1<<4, 100)])
+        ...
+        """
+        # pigpio message format
+
+        # I p1 0
+        # I p2 0
+        # I p3 pulses * 12
+        # (optional) extension
+        # III on/off/delay * pulses
+        data = pack_pulses(pulses)
+        if not len(data):
+            return 0
+        size = len(data) * 4
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_WVAG, 0, 0,
+                                                      size, [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_add_serial(self, user_gpio, baud, data, offset=0, bb_bits=8,
+                        bb_stop=2):
+        """
+        Adds a waveform representing serial data to the existing
+        waveform (if any).  The serial data starts offset
+        microseconds from the start of the waveform.
+
+        user_gpio:= gpio to transmit data.  You must set the gpio mode
+                    to output.
+             baud:= 50-1000000 bits per second.
+             data:= the bytes to write.
+           offset:= number of microseconds from the start of the
+                     waveform, default 0.
+          bb_bits:= number of data bits, default 8.
+          bb_stop:= number of stop half bits, default 2.
+
+        Returns the new total number of pulses in the current waveform.
+
+        ...
+        yield from pi.wave_add_serial(4, 300, b'Hello world')
+        ...
+        """
+        # pigpio message format
+
+        # I p1 gpio
+        # I p2 baud
+        # I p3 len+12
+        # (optional) extension
+        # I bb_bits
+        # I bb_stop
+        # I offset
+        # s len data bytes
+        if not len(data):
+            return 0
+        if isinstance(data, str):
+            data = _b(data)
+        extents = [struct.pack('III', bb_bits, bb_stop, offset), data]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_WVAS,
+                                                      user_gpio, baud,
+                                                      len(data) + 12,
+                                                      extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_create(self):
+        """
+        Creates a waveform from the data provided by the prior calls
+        to the wave_add_* functions.
+
+        Returns a wave id (>=0) if OK.
+
+        The data provided by the wave_add_* functions is consumed by
+        this function.
+
+        ...
+        wid = yield from pi.wave_create()
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVCRE, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_create_from(self, pulses):
+        """
+        Creates a waveform from pulses and returns its wave id.
+
+        pulses:= the pulses, see wave_add_generic.
+
+        The waveform under construction in gpiod is shared by all its
+        clients: wave_add_new, wave_add_generic and wave_create are run
+        while holding a lock, so that waveforms created concurrently by
+        this Pi are not mixed.
+
+        ...
+        wid = yield from pi.wave_create_from(builder)
+        ...
+        """
+        yield from self._wave_lock.acquire()
+        try:
+            yield from self.wave_add_new()
+            yield from self.wave_add_generic(pulses)
+            wave_id = yield from self.wave_create()
+        finally:
+            self._wave_lock.release()
+        return wave_id
+
+    @asyncio.coroutine
+    def wave_delete(self, wave_id):
+        """
+        Deletes a waveform.
+
+        wave_id:= >=0 (as returned by a prior call to wave_create).
+
+        ...
+        yield from pi.wave_delete(6)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVDEL, wave_id, 0)
+        self._wave_cache.discard(wave_id)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_send_once(self, wave_id):
+        """
+        Transmits a waveform once.
+
+        wave_id:= >=0 (as returned by a prior call to wave_create).
+
+        Returns the number of DMA control blocks used in the waveform.
+
+        ...
+        cbs = yield from pi.wave_send_once(wid)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVTX, wave_id, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_send_repeat(self, wave_id):
+        """
+        Transmits a waveform repeatedly, until wave_tx_stop is called
+        or another waveform is transmitted.
+
+        wave_id:= >=0 (as returned by a prior call to wave_create).
+
+        Returns the number of DMA control blocks used in the waveform.
+
+        ...
+        cbs = yield from pi.wave_send_repeat(wid)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVTXR, wave_id, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_chain(self, data):
+        """
+        Transmits a chain of waveforms.
+
+        data:= the wave ids and chain commands (loops and delays), as
+               bytes or a list of integers 0-255.
+
+        ...
+        yield from pi.wave_chain([
+            255, 0,           # loop start
+               wid0,
+               255, 2, 0x88, 0x13,   # delay 5000 us
+               wid1,
+            255, 1, 30, 0,    # loop end, 30 times
+        ])
+        ...
+        """
+        # I p1 0
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        data = bytes(data) if not isinstance(data, str) else _b(data)
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_WVCHA, 0, 0,
+                                                      len(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_send_chain(self, chain):
+        """
+        Transmits a WaveChain, a high level sequence of segments, delays
+        and loops.
+
+        chain:= an apigpio.wave.WaveChain.
+
+        The waveforms of the segments are created as needed and kept in
+        gpiod for later chains, identical segments share a waveform. When
+        gpiod runs out of waveforms, the least recently used ones are
+        deleted: no chain using them may be transmitting anymore.
+
+        ...
+        chain = WaveChain()
+        chain.loop(100).add(step).delay(2000)
+        yield from pi.wave_send_chain(chain)
+        yield from pi.wave_tx_wait()
+        ...
+        """
+        wave_ids = yield from self._wave_cache.wave_ids(chain)
+        res = yield from self.wave_chain(chain.compile(wave_ids))
+        return res
+
+    @asyncio.coroutine
+    def wave_tx_busy(self):
+        """
+        Returns 1 if a waveform is currently being transmitted,
+        otherwise 0.
+
+        ...
+        busy = yield from pi.wave_tx_busy()
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVBSY, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_tx_wait(self, interval=0.001):
+        """
+        Waits until the current waveform transmission is done.
+
+        interval:= the delay in seconds between two polls of gpiod.
+
+        ...
+        yield from pi.wave_send_once(wid)
+        yield from pi.wave_tx_wait()
+        ...
+        """
+        while (yield from self.wave_tx_busy()):
+            yield from asyncio.sleep(interval, loop=self._loop)
+
+    @asyncio.coroutine
+    def wave_tx_stop(self):
+        """
+        Stops the transmission of the current waveform.
+
+        ...
+        yield from pi.wave_tx_stop()
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVHLT, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_micros(self):
+        """Returns the length in microseconds of the current waveform."""
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSM, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_max_micros(self):
+        """Returns the maximum possible size of a waveform in microseconds."""
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSM, 2, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_pulses(self):
+        """Returns the length in pulses of the current waveform."""
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSP, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_max_pulses(self):
+        """Returns the maximum possible size of a waveform in pulses."""
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSP, 2, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_cbs(self):
+        """
+        Returns the length in DMA control blocks of the current
+        waveform.
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSC, 0, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def wave_get_max_cbs(self):
+        """
+        Returns the maximum possible size of a waveform in DMA control
+        blocks.
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_WVSC, 2, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_open(self, i2c_bus, i2c_address, i2c_flags=0):
+        """
+        Returns a handle (>=0) for the device at the I2C bus address.
+
+            i2c_bus:= >=0.
+        i2c_address:= 0-0x7F.
+          i2c_flags:= 0, no flags are currently defined.
+
+        ...
+        h = yield from pi.i2c_open(1, 0x53) # open device at address 0x53
+        ...
+        """
+        # I p1 i2c_bus
+        # I p2 i2c_addr
+        # I p3 4
+        # (optional) extension
+        # I i2c_flags
+        extents = [struct.pack('I', i2c_flags)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CO, i2c_bus,
+                                                      i2c_address, 4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_close(self, handle):
+        """
+        Closes the I2C device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+
+        ...
+        yield from pi.i2c_close(h)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CC, handle, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_write_quick(self, handle, bit):
+        """
+        Sends a single bit to the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           bit:= 0 or 1, the value to write.
+
+        ...
+        yield from pi.i2c_write_quick(0, 1) # send 1 to device 0
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CWQ, handle, bit)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_write_byte(self, handle, byte_val):
+        """
+        Sends a single byte to the device associated with handle.
+
+          handle:= >=0 (as returned by a prior call to i2c_open).
+        byte_val:= 0-255, the value to write.
+
+        ...
+        yield from pi.i2c_write_byte(1, 17)   # send byte   17 to device 1
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CWS, handle,
+                                                  byte_val)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_read_byte(self, handle):
+        """
+        Reads a single byte from the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+
+        ...
+        b = yield from pi.i2c_read_byte(2) # read a byte from device 2
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CRS, handle, 0)
         return _u2i(res)
 
-    def __init__(self, loop=None):
+    @asyncio.coroutine
+    def i2c_write_byte_data(self, handle, reg, byte_val):
+        """
+        Writes a single byte to the specified register of the device
+        associated with handle.
+
+          handle:= >=0 (as returned by a prior call to i2c_open).
+             reg:= >=0, the device register.
+        byte_val:= 0-255, the value to write.
+
+        ...
+        # send byte 0xC5 to reg 2 of device 1
+        yield from pi.i2c_write_byte_data(1, 2, 0xC5)
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 4
+        # (optional) extension
+        # I byte_val
+        extents = [struct.pack('I', byte_val)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CWB, handle,
+                                                      reg, 4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_write_word_data(self, handle, reg, word_val):
+        """
+        Writes a single 16 bit word to the specified register of the
+        device associated with handle.
+
+          handle:= >=0 (as returned by a prior call to i2c_open).
+             reg:= >=0, the device register.
+        word_val:= 0-65535, the value to write.
+
+        ...
+        # send word 0xA0C5 to reg 5 of device 4
+        yield from pi.i2c_write_word_data(4, 5, 0xA0C5)
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 4
+        # (optional) extension
+        # I word_val
+        extents = [struct.pack('I', word_val)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CWW, handle,
+                                                      reg, 4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_read_byte_data(self, handle, reg):
+        """
+        Reads a single byte from the specified register of the device
+        associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+
+        ...
+        # read byte from reg 17 of device 2
+        b = yield from pi.i2c_read_byte_data(2, 17)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CRB, handle, reg)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_read_word_data(self, handle, reg):
+        """
+        Reads a single 16 bit word from the specified register of the
+        device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+
+        ...
+        # read word from reg 2 of device 3
+        w = yield from pi.i2c_read_word_data(3, 2)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_I2CRW, handle, reg)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_process_call(self, handle, reg, word_val):
+        """
+        Writes 16 bits of data to the specified register of the device
+        associated with handle and reads 16 bits of data in return.
+
+          handle:= >=0 (as returned by a prior call to i2c_open).
+             reg:= >=0, the device register.
+        word_val:= 0-65535, the value to write.
+
+        ...
+        r = yield from pi.i2c_process_call(h, 4, 0x1231)
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 4
+        # (optional) extension
+        # I word_val
+        extents = [struct.pack('I', word_val)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CPC, handle,
+                                                      reg, 4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_write_block_data(self, handle, reg, data):
+        """
+        Writes up to 32 bytes to the specified register of the device
+        associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+          data:= the bytes to write.
+
+        ...
+        yield from pi.i2c_write_block_data(4, 5, b'hello')
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        if not len(data):
+            return 0
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CWK, handle,
+                                                      reg, len(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_read_block_data(self, handle, reg, buf=None):
+        """
+        Reads a block of up to 32 bytes from the specified register of
+        the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+           buf:= an optional writable buffer the data is received in,
+                 without any copy, when it is large enough.
+
+        The amount of returned data is set by the device.
+
+        The returned value is a tuple of the number of bytes read and the
+        data, a memoryview on buf when it is given. An ApigpioError is
+        raised if there was an error.
+
+        ...
+        (b, d) = yield from pi.i2c_read_block_data(h, 10)
+        if b >= 0:
+            # process data
+        else:
+            # process read failure
+        ...
+        """
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_I2CRK,
+                                                           handle, reg,
+                                                           buf=buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def i2c_block_process_call(self, handle, reg, data, buf=None):
+        """
+        Writes data bytes to the specified register of the device
+        associated with handle and reads a device specified number
+        of bytes of data in return.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+          data:= the bytes to write.
+           buf:= an optional writable buffer the data is received in.
+
+        The returned value is a tuple of the number of bytes read and the
+        data, see i2c_read_block_data.
+
+        ...
+        (b, d) = yield from pi.i2c_block_process_call(h, 10, b'\x02\x05\x00')
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_I2CPK,
+                                                           handle, reg,
+                                                           len(data), [data],
+                                                           buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        """
+        Writes data bytes to the specified register of the device
+        associated with handle.  1-32 bytes may be written.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+          data:= the bytes to write.
+
+        ...
+        yield from pi.i2c_write_i2c_block_data(4, 5, b'hello')
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        if not len(data):
+            return 0
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CWI, handle,
+                                                      reg, len(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_read_i2c_block_data(self, handle, reg, count, buf=None):
+        """
+        Reads count bytes from the specified register of the device
+        associated with handle .  The count may be 1-32.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+           reg:= >=0, the device register.
+         count:= >0, the number of bytes to read.
+           buf:= an optional writable buffer the data is received in.
+
+        The returned value is a tuple of the number of bytes read and the
+        data, see i2c_read_block_data.
+
+        ...
+        buf = bytearray(6)
+        (b, d) = yield from pi.i2c_read_i2c_block_data(h, 4, 6, buf)
+        ...
+        """
+        # I p1 handle
+        # I p2 reg
+        # I p3 4
+        # (optional) extension
+        # I count
+        extents = [struct.pack('I', count)]
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_I2CRI,
+                                                           handle, reg, 4,
+                                                           extents, buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def i2c_read_device(self, handle, count, buf=None):
+        """
+        Returns count bytes read from the raw device associated
+        with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+         count:= >0, the number of bytes to read.
+           buf:= an optional writable buffer the data is received in.
+
+        The returned value is a tuple of the number of bytes read and the
+        data, see i2c_read_block_data.
+
+        ...
+        (count, data) = yield from pi.i2c_read_device(h, 12)
+        ...
+        """
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_I2CRD,
+                                                           handle, count,
+                                                           buf=buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def i2c_write_device(self, handle, data):
+        """
+        Writes the data bytes to the raw device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+          data:= the bytes to write.
+
+        ...
+        yield from pi.i2c_write_device(h, b'\x12\x34\xA2')
+        ...
+        """
+        # I p1 handle
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        if not len(data):
+            return 0
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_I2CWD, handle,
+                                                      0, len(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def i2c_zip(self, handle, data, buf=None):
+        """
+        This function executes a sequence of I2C operations.  The
+        operations to be performed are specified by the contents of data
+        which contains the concatenated command codes and associated data.
+
+        handle:= >=0 (as returned by a prior call to i2c_open).
+          data:= the concatenated I2C commands, see below.
+           buf:= an optional writable buffer the data is received in.
+
+        The returned value is a tuple of the number of bytes read and the
+        data read, see i2c_read_block_data.
+
+        ...
+        (count, data) = yield from pi.i2c_zip(h, [4, 0x53, 7, 1, 0x32, 6, 6, 0])
+        ...
+
+        The following command codes are supported:
+
+        Name    @ Cmd & Data @ Meaning
+        End     @ 0          @ No more commands
+        Escape  @ 1          @ Next P is two bytes
+        On      @ 2          @ Switch combined flag on
+        Off     @ 3          @ Switch combined flag off
+        Address @ 4 P        @ Set I2C address to P
+        Flags   @ 5 lsb msb  @ Set I2C flags to lsb + (msb << 8)
+        Read    @ 6 P        @ Read P bytes of data
+        Write   @ 7 P ...    @ Write P bytes of data
+
+        The address, read, and write commands take a parameter P.
+        Normally P is one byte (0-255).  If the command is preceded by
+        the Escape command then P is two bytes (0-65535, least
+        significant byte first).
+
+        The address defaults to that associated with the handle.
+        The flags default to 0.  The address and flags maintain
+        their previous value until updated.
+
+        apigpio.i2c.I2CTransaction builds and runs such sequences.
+        """
+        # I p1 handle
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        data = bytes(data) if not isinstance(data, str) else _b(data)
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_I2CZ,
+                                                           handle, 0,
+                                                           len(data), [data],
+                                                           buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def spi_open(self, spi_channel, baud, spi_flags=0):
+        """
+        Returns a handle for the SPI device on channel.  Data will be
+        transferred at baud bits per second.  The flags may be used to
+        modify the default behaviour of 4-wire operation, mode 0,
+        active low chip select.
+
+        spi_channel:= 0-1 (0-2 for the auxiliary SPI device).
+               baud:= 32K-125M (values above 30M are unlikely to work).
+          spi_flags:= see the pigpio spiOpen documentation.
+
+        ...
+        # open SPI device on channel 1 in mode 3 at 50000 bits per second
+        h = yield from pi.spi_open(1, 50000, 3)
+        ...
+        """
+        # I p1 spi_channel
+        # I p2 baud
+        # I p3 4
+        # (optional) extension
+        # I spi_flags
+        extents = [struct.pack('I', spi_flags)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_SPIO,
+                                                      spi_channel, baud, 4,
+                                                      extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def spi_close(self, handle):
+        """
+        Closes the SPI device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to spi_open).
+
+        ...
+        yield from pi.spi_close(h)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SPIC, handle, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def spi_read(self, handle, count, buf=None):
+        """
+        Reads count bytes from the SPI device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to spi_open).
+         count:= >0, the number of bytes to read.
+           buf:= an optional writable buffer the data is received in,
+                 without any copy, when it is large enough.
+
+        The returned value is a tuple of the number of bytes read and the
+        data, a memoryview on buf when it is given. An ApigpioError is
+        raised if there was an error.
+
+        ...
+        (b, d) = yield from pi.spi_read(h, 60) # read 60 bytes from device h
+        ...
+        """
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_SPIR,
+                                                           handle, count,
+                                                           buf=buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def spi_write(self, handle, data):
+        """
+        Writes the data bytes to the SPI device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to spi_open).
+          data:= the bytes to write, any buffer.
+
+        ...
+        yield from pi.spi_write(0, b'\x02\xc0\x80') # write 3 bytes to device 0
+        ...
+        """
+        # I p1 handle
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_SPIW, handle, 0,
+                                                      _nbytes(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def spi_xfer(self, handle, data, buf=None):
+        """
+        Writes the data bytes to the SPI device associated with handle,
+        returning the data bytes read from the device.
+
+        handle:= >=0 (as returned by a prior call to spi_open).
+          data:= the bytes to write, any buffer.
+           buf:= an optional writable buffer the data read is received in,
+                 so that it can be reused from one transfer to the next.
+
+        The returned value is a tuple of the number of bytes read and the
+        data read, see spi_read.
+
+        ...
+        buf = bytearray(3)
+        (count, rx_data) = yield from pi.spi_xfer(h, b'\x01\x80\x00', buf)
+        ...
+        """
+        # I p1 handle
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_SPIX,
+                                                           handle, 0,
+                                                           _nbytes(data),
+                                                           [data], buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def spi_xfer_many(self, handle, transfers, bufs=None):
+        """
+        Runs several SPI transfers, sent with a single socket write and
+        pipelined by gpiod, and returns the list of their (count, data)
+        results.
+
+           handle:= >=0 (as returned by a prior call to spi_open).
+        transfers:= the data of each transfer, any buffers.
+             bufs:= optional buffers the data read by each transfer is
+                     received in, one per transfer, see spi_xfer.
+
+        ...
+        cmd = b'\x01\x80\x00'
+        res = yield from pi.spi_xfer_many(h, [cmd] * 16)
+        ...
+        """
+        data = bytearray()
+        replies = []
+        if bufs is None:
+            bufs = [None] * len(transfers)
+        elif len(bufs) != len(transfers):
+            raise ValueError('bufs must hold one buffer per transfer')
+        for tx, buf in zip(transfers, bufs):
+            data += _CMD.pack(_PI_CMD_SPIX, handle, 0, _nbytes(tx))
+            data += tx
+            replies.append((True, buf))
+        if not replies:
+            return []
+        channel = self._channel_for(_PI_CMD_SPIX)
+        responses = yield from channel.commands(data, replies)
+        return [(_u2i(res), rx) for res, rx in responses]
+
+    @asyncio.coroutine
+    def serial_open(self, tty, baud, ser_flags=0):
+        """
+        Returns a handle for the serial tty device opened
+        at baud bits per second.
+
+              tty:= the serial device to open.
+             baud:= baud rate in bits per second, see below.
+        ser_flags:= 0, no flags are currently defined.
+
+        The baud rate must be one of 50, 75, 110, 134, 150,
+        200, 300, 600, 1200, 1800, 2400, 4800, 9600, 19200,
+        38400, 57600, 115200, or 230400.
+
+        ...
+        h1 = yield from pi.serial_open("/dev/ttyAMA0", 300)
+        ...
+        """
+        # I p1 baud
+        # I p2 ser_flags
+        # I p3 len
+        # (optional) extension
+        # s len tty
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_SERO, baud,
+                                                      ser_flags, len(tty),
+                                                      [tty])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def serial_close(self, handle):
+        """
+        Closes the serial device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to serial_open).
+
+        ...
+        yield from pi.serial_close(h1)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SERC, handle, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def serial_read_byte(self, handle):
+        """
+        Returns a single byte from the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to serial_open).
+
+        ...
+        b = yield from pi.serial_read_byte(h1)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SERRB, handle, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def serial_write_byte(self, handle, byte_val):
+        """
+        Writes a single byte to the device associated with handle.
+
+          handle:= >=0 (as returned by a prior call to serial_open).
+        byte_val:= 0-255, the value to write.
+
+        ...
+        yield from pi.serial_write_byte(h1, 23)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SERWB, handle,
+                                                  byte_val)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def serial_read(self, handle, count=1000, buf=None):
+        """
+        Reads up to count bytes from the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to serial_open).
+         count:= >0, the number of bytes to read (defaults to 1000).
+           buf:= an optional writable buffer the data is received in,
+                 without any copy, when it is large enough.
+
+        The returned value is a tuple of the number of bytes read and
+        the data, a memoryview on buf when it is given. No data
+        available gives (0, b'').
+
+        ...
+        (b, d) = yield from pi.serial_read(h2, 100)
+        if b > 0:
+            # process read data
+        ...
+        """
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_SERR,
+                                                           handle, count,
+                                                           buf=buf)
+        if u2i(res) == PI_SER_READ_NO_DATA:
+            return 0, b''
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def serial_write(self, handle, data):
+        """
+        Writes the data bytes to the device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to serial_open).
+          data:= the bytes to write.
+
+        ...
+        yield from pi.serial_write(h1, b'\x02\x03\x04')
+        ...
+        """
+        # I p1 handle
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_SERW, handle, 0,
+                                                      _nbytes(data), [data])
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def serial_data_available(self, handle):
+        """
+        Returns the number of bytes available to be read from the
+        device associated with handle.
+
+        handle:= >=0 (as returned by a prior call to serial_open).
+
+        ...
+        rdy = yield from pi.serial_data_available(h1)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SERDA, handle, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_serial_read_open(self, user_gpio, baud, bb_bits=8):
+        """
+        Opens a gpio for bit bang reading of serial data.
+
+        user_gpio:= 0-31, the gpio to use.
+             baud:= 50-250000
+          bb_bits:= 1-32
+
+        The serial data is held in a cyclic buffer and is read using
+        bb_serial_read.
+
+        It is the caller's responsibility to read data from the cyclic
+        buffer in a timely fashion.
+
+        ...
+        status = yield from pi.bb_serial_read_open(4, 19200)
+        ...
+        """
+        # I p1 user_gpio
+        # I p2 baud
+        # I p3 4
+        # (optional) extension
+        # I bb_bits
+        extents = [struct.pack('I', bb_bits)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_SLRO, user_gpio,
+                                                      baud, 4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_serial_read(self, user_gpio, count=10000, buf=None):
+        """
+        Returns data from the bit bang serial cyclic buffer.
+
+        user_gpio:= 0-31 (opened in a prior call to bb_serial_read_open)
+            count:= maximum number of bytes to read, defaults to 10000,
+                    the most gpiod returns at once.
+              buf:= an optional writable buffer the data is received in,
+                    without any copy, when it is large enough.
+
+        The returned value is a tuple of the number of bytes read and a
+        bytearray containing the bytes (a memoryview on buf when it is
+        given).  An ApigpioError is raised if there was an error.
+
+        The bytes returned for each character depend upon the number of
+        data bits bb_bits specified in the bb_serial_read_open command.
+
+        For bb_bits 1-8 there will be one byte per character.
+        For bb_bits 9-16 there will be two bytes per character.
+        For bb_bits 17-32 there will be four bytes per character.
+
+        ...
+        (count, data) = yield from pi.bb_serial_read(4)
+        ...
+        """
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_SLR,
+                                                           user_gpio, count,
+                                                           buf=buf)
+        return _u2i(res), data
+
+    @asyncio.coroutine
+    def bb_serial_read_close(self, user_gpio):
+        """
+        Closes a gpio for bit bang reading of serial data.
+
+        user_gpio:= 0-31 (opened in a prior call to bb_serial_read_open)
+
+        ...
+        status = yield from pi.bb_serial_read_close(17)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SLRC, user_gpio, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_serial_invert(self, user_gpio, invert):
+        """
+        Invert serial logic.
+
+        user_gpio:= 0-31 (opened in a prior call to bb_serial_read_open)
+           invert:= 0-1 (1 invert, 0 normal)
+
+        ...
+        status = yield from pi.bb_serial_invert(17, 1)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_SLRI, user_gpio,
+                                                  invert)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_i2c_open(self, SDA, SCL, baud=100000):
+        """
+        This function selects a pair of gpios for bit banging I2C at a
+        specified baud rate.
+
+         SDA:= 0-31
+         SCL:= 0-31
+        baud:= 50-500000
+
+        Bit banging I2C allows for certain operations which are not possible
+        with the standard I2C driver.
+
+        o baud rates as low as 50
+        o repeated starts
+        o clock stretching
+        o I2C on any pair of spare gpios
+
+        ...
+        h = yield from pi.bb_i2c_open(4, 5, 50000) # bit bang on gpio 4/5
+        ...
+        """
+        # I p1 SDA
+        # I p2 SCL
+        # I p3 4
+        # (optional) extension
+        # I baud
+        extents = [struct.pack('I', baud)]
+        res = yield from self._pigpio_aio_command_ext(_PI_CMD_BI2CO, SDA, SCL,
+                                                      4, extents)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_i2c_close(self, SDA):
+        """
+        This function stops bit banging I2C on a pair of gpios
+        previously opened with bb_i2c_open.
+
+        SDA:= 0-31, the SDA gpio used in a prior call to bb_i2c_open
+
+        ...
+        yield from pi.bb_i2c_close(SDA)
+        ...
+        """
+        res = yield from self._pigpio_aio_command(_PI_CMD_BI2CC, SDA, 0)
+        return _u2i(res)
+
+    @asyncio.coroutine
+    def bb_i2c_zip(self, SDA, data, buf=None):
+        """
+        This function executes a sequence of bit banged I2C operations.
+        The operations to be performed are specified by the contents
+        of data which contains the concatenated command codes and
+        associated data.
+
+         SDA:= 0-31 (as used in a prior call to bb_i2c_open)
+        data:= the concatenated I2C commands, see below.
+         buf:= an optional writable buffer the data is received in.
+
+        The returned value is a tuple of the number of bytes read and the
+        data read, see i2c_read_block_data.
+
+        ...
+        (count, data) = yield from pi.bb_i2c_zip(
+                           SDA, [4, 0x53, 2, 7, 1, 0x32, 2, 6, 6, 3, 0])
+        ...
+
+        The following command codes are supported:
+
+        Name    @ Cmd & Data   @ Meaning
+        End     @ 0            @ No more commands
+        Escape  @ 1            @ Next P is two bytes
+        Start   @ 2            @ Start condition
+        Stop    @ 3            @ Stop condition
+        Address @ 4 P          @ Set I2C address to P
+        Flags   @ 5 lsb msb    @ Set I2C flags to lsb + (msb << 8)
+        Read    @ 6 P          @ Read P bytes of data
+        Write   @ 7 P ...      @ Write P bytes of data
+
+        The address, read, and write commands take a parameter P.
+        Normally P is one byte (0-255).  If the command is preceded by
+        the Escape command then P is two bytes (0-65535, least
+        significant byte first).
+
+        The address and flags default to 0.  The address and flags maintain
+        their previous value until updated.
+
+        apigpio.i2c.I2CTransaction builds and runs such sequences.
+        """
+        # I p1 SDA
+        # I p2 0
+        # I p3 len
+        # (optional) extension
+        # s len data bytes
+        data = bytes(data) if not isinstance(data, str) else _b(data)
+        res, data = yield from self._pigpio_aio_command_rx(_PI_CMD_BI2CZ,
+                                                           SDA, 0,
+                                                           len(data), [data],
+                                                           buf)
+        return _u2i(res), data
+
+    def __init__(self, loop=None, callback_concurrency=8,
+                 callback_queue=1024, state_cache=False):
+        """
+        loop:= the asyncio event loop, the current one if not given.
+        callback_concurrency:= maximum number of coroutine callbacks
+                               running at the same time.
+        callback_queue:= maximum number of calls queued for each coroutine
+                         callback.
+        state_cache:= if True, the state of the gpios set through this
+                      client is cached: commands which would not change it
+                      are not sent, get_mode is answered from the cache
+                      when possible, and read from the cache for outputs
+                      and from the notifications for monitored inputs.
+                      Use invalidate_cache if the gpios may be changed by
+                      another client.
+        """
         if loop is None:
             loop = asyncio.get_event_loop()
         self._loop = loop
         self.s = None
-        self._notify = _callback_handler(self)
-        self._lock = asyncio.Lock()
+        self._channel = None
+        self._channels = []
+        self._bulk = None
+        self._notify = _callback_handler(self, callback_concurrency,
+                                         callback_queue)
+        self._cache = _state_cache() if state_cache else None
+        # PWM ranges and frequencies set or read through this client
+        self._pwm_ranges = {}
+        self._pwm_frequencies = {}
+        # shared scheduler of the ramps, see ramp
+        self._ramper = None
+        # serializes the construction of waveforms, see wave_create_from
+        self._wave_lock = asyncio.Lock(loop=loop)
+        # waveforms created for wave chains, see wave_send_chain
+        self._wave_cache = WaveCache(self)
@@ -0,0 +1,163 @@
+import asyncio
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _report_dtype():
+    # Same layout as the 'HHII' reports sent by gpiod.
+    return np.dtype([('seq', np.uint16), ('flags', np.uint16),
+                     ('tick', np.uint32), ('level', np.uint32)])
+
+
+class Capture(object):
+    """
+    Records the notification reports received from gpiod in a preallocated
+    NumPy ring buffer of (seq, flags, tick, level) samples.
+
+    Reports are copied a whole chunk at a time, without any per report
+    Python processing. The ring buffer holds the levels of all the bank 1
+    gpios at each report, reports are sent by gpiod whenever one of the
+    monitored gpios changes (including the gpios monitored by callbacks).
+
+    ...
+    cap = pi.capture([18, 23], size=100000)
+    yield from cap.start()
+    yield from asyncio.sleep(1)
+    samples = cap.window(1000000)  # reports of the last second
+    ticks, levels = apigpio.capture.gpio_edges(samples, 18)
+    yield from cap.stop()
+    ...
+    """
+
+    def __init__(self, pi, gpios, size=65536):
+        if np is None:
+            raise ImportError('apigpio capture requires numpy')
+        self._notify = pi._notify
+        self._bits = 0
+        for gpio in gpios:
+            self._bits |= 1 << gpio
+        self.buffer = np.zeros(size, dtype=_report_dtype())
+        # total number of reports received since the capture started
+        self.count = 0
+
+    @property
+    def dropped(self):
+        """Number of reports overwritten because the buffer was full."""
+        return max(0, self.count - len(self.buffer))
+
+    def __len__(self):
+        return min(self.count, len(self.buffer))
+
+    @asyncio.coroutine
+    def start(self):
+        """Starts recording reports."""
+        yield from self._notify.add_sink(self._on_reports, self._bits)
+
+    @asyncio.coroutine
+    def stop(self):
+        """Stops recording reports, the samples are kept."""
+        yield from self._notify.remove_sink(self._on_reports)
+
+    def clear(self):
+        """Discards all the recorded samples."""
+        self.count = 0
+
+    def _on_reports(self, data):
+        reports = np.frombuffer(data, dtype=self.buffer.dtype)
+        size = len(self.buffer)
+        n = len(reports)
+        if n > size:
+            self.count += n - size
+            reports = reports[n - size:]
+            n = size
+        pos = self.count % size
+        first = min(n, size - pos)
+        self.buffer[pos:pos + first] = reports[:first]
+        self.buffer[:n - first] = reports[first:]
+        self.count += n
+
+    def _segments(self):
+        # (older, newer) parts of the ring buffer, in reception order
+        size = len(self.buffer)
+        if self.count <= size:
+            return self.buffer[:0], self.buffer[:self.count]
+        pos = self.count % size
+        return self.buffer[pos:], self.buffer[:pos]
+
+    def samples(self):
+        """
+        Returns all the recorded samples in reception order, as a view of
+        the buffer when they are contiguous in it, otherwise as a copy.
+        """
+        older, newer = self._segments()
+        if not len(older):
+            return newer
+        return np.concatenate((older, newer))
+
+    def window(self, duration):
+        """
+        Returns the samples received in the last duration microseconds
+        (according to the gpiod ticks), as a view of the buffer when they
+        are contiguous in it, otherwise as a copy.
+        """
+        older, newer = self._segments()
+        if len(newer):
+            newest = newer['tick'][-1]
+        elif len(older):
+            newest = older['tick'][-1]
+        else:
+            return newer
+        recent = _recent(newer, newest, duration)
+        if len(recent) == len(newer) and len(older):
+            older = _recent(older, newest, duration)
+            if not len(recent):
+                return older
+            if len(older):
+                return np.concatenate((older, recent))
+        return recent
+
+
+def _recent(samples, newest, duration):
+    # Ages are computed modulo 2**32, so that they are not affected by a
+    # wrap around of the ticks, and decrease in reception order.
+    ages = np.uint32(newest) - samples['tick']
+    count = np.searchsorted(ages[::-1], duration, side='right')
+    return samples[len(samples) - count:]
+
+
+def unwrap_ticks(ticks, start=0):
+    """
+    Converts a sequence of 32 bit gpiod ticks, which wrap around about
+    every 72 minutes, into monotonic 64 bit ticks.
+
+    ticks:= the ticks, in reception order, wrapping around at most once
+            between two consecutive ticks.
+    start:= an extended tick, the result is offset by the number of wrap
+            arounds it holds.
+    """
+    ticks = np.asarray(ticks, dtype=np.int64)
+    wraps = np.empty(len(ticks), dtype=np.int64)
+    if len(ticks):
+        wraps[0] = 0
+        np.cumsum(ticks[1:] < ticks[:-1], out=wraps[1:])
+    return ticks + ((wraps + (start >> 32)) << 32)
+
+
+def gpio_edges(samples, gpio):
+    """
+    Returns the (ticks, levels) arrays of the level changes of a gpio in
+    recorded samples.
+
+    samples:= samples from a Capture.
+       gpio:= 0-31.
+
+    The first sample gives the initial level of the gpio and is not
+    considered as an edge. Watchdog and keep alive reports are ignored.
+    """
+    samples = samples[samples['flags'] == 0]
+    levels = (samples['level'] >> gpio) & 1
+    idx = np.flatnonzero(levels[1:] != levels[:-1]) + 1
+    return samples['tick'][idx], levels[idx].astype(np.uint8)
@@ -17,6 +17,12 @@ RISING_EDGE = 0
 FALLING_EDGE = 1
 EITHER_EDGE = 2
 
+# debounce modes
+
+DEBOUNCE_LEADING = 0
+DEBOUNCE_TRAILING = 1
+DEBOUNCE_SETTLE = 2
+
 # gpio modes
 
 INPUT = 0
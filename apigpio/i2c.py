@@ -0,0 +1,159 @@
+import asyncio
+import functools
+
+# zip command codes, shared by i2c_zip and bb_i2c_zip
+_ZIP_END = 0
+_ZIP_ESCAPE = 1
+_ZIP_ON = 2      # combined flag on (i2c_zip) / start (bb_i2c_zip)
+_ZIP_OFF = 3     # combined flag off (i2c_zip) / stop (bb_i2c_zip)
+_ZIP_ADDRESS = 4
+_ZIP_FLAGS = 5
+_ZIP_READ = 6
+_ZIP_WRITE = 7
+
+
+def _param(code, cmd, p):
+    # P is one byte, or two bytes (lsb first) after an escape.
+    if p > 0xFF:
+        code.extend((_ZIP_ESCAPE, cmd, p & 0xFF, p >> 8))
+    else:
+        code.extend((cmd, p))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(steps):
+    """
+    Returns the zip command bytes of a sequence of steps, cached so that
+    transactions of the same shape are only compiled once.
+    """
+    code = bytearray()
+    for op, arg in steps:
+        if op == _ZIP_WRITE:
+            _param(code, _ZIP_WRITE, len(arg))
+            code.extend(arg)
+        elif op in (_ZIP_ADDRESS, _ZIP_READ):
+            _param(code, op, arg)
+        elif op == _ZIP_FLAGS:
+            code.extend((_ZIP_FLAGS, arg & 0xFF, arg >> 8))
+        else:
+            code.append(op)
+    code.append(_ZIP_END)
+    return bytes(code)
+
+
+class I2CTransaction(object):
+    """
+    A sequence of I2C operations run by gpiod in a single zip command,
+    so that for example a register write followed by a read is a single
+    socket exchange.
+
+    The steps are compiled once into the zip command, and the data read
+    is received in a buffer owned by the transaction, then split per read
+    step. A transaction may be run any number of times.
+
+    ...
+    tx = I2CTransaction().write(0x32).read(6)
+    (xyz,) = yield from tx.execute(pi, h)
+
+    bb = I2CTransaction().address(0x53).start().write(0x32)
+    bb.start().read(6).stop()
+    (xyz,) = yield from bb.execute_bb(pi, SDA)
+    ...
+    """
+
+    def __init__(self):
+        self._steps = []
+        self._reads = []
+        self._code = None
+        self._buf = None
+
+    def _add(self, op, arg=None):
+        self._steps.append((op, arg))
+        self._code = None
+        return self
+
+    def address(self, address):
+        """Sets the I2C address of the following operations."""
+        return self._add(_ZIP_ADDRESS, address)
+
+    def flags(self, flags):
+        """Sets the I2C flags of the following operations."""
+        return self._add(_ZIP_FLAGS, flags)
+
+    def write(self, data):
+        """Writes data, bytes or a single byte value."""
+        if isinstance(data, int):
+            data = bytes((data,))
+        return self._add(_ZIP_WRITE, bytes(data))
+
+    def read(self, count):
+        """Reads count bytes, returned as a separate result."""
+        self._reads.append(count)
+        self._buf = None
+        return self._add(_ZIP_READ, count)
+
+    def combined(self, on=True):
+        """
+        Switches the combined flag on or off, i2c_zip only: with the flag
+        on, the operations are not separated by stop conditions.
+        """
+        return self._add(_ZIP_ON if on else _ZIP_OFF)
+
+    def start(self):
+        """Sends a start condition, bb_i2c_zip only."""
+        return self._add(_ZIP_ON)
+
+    def stop(self):
+        """Sends a stop condition, bb_i2c_zip only."""
+        return self._add(_ZIP_OFF)
+
+    def compile(self):
+        """Returns the zip command bytes of the transaction."""
+        if self._code is None:
+            self._code = _compile(tuple(self._steps))
+        return self._code
+
+    def split(self, count, data):
+        """
+        Splits the data read by the zip command into the results of the
+        read steps, as memoryviews.
+        """
+        results = []
+        view = memoryview(data)
+        count = max(count, 0)
+        pos = 0
+        for size in self._reads:
+            end = min(pos + size, count)
+            results.append(view[pos:end])
+            pos = end
+        return results
+
+    def _buffer(self):
+        if self._buf is None:
+            self._buf = bytearray(max(1, sum(self._reads)))
+        return self._buf
+
+    @asyncio.coroutine
+    def execute(self, pi, handle):
+        """
+        Runs the transaction on a device opened with i2c_open.
+
+        Returns the list of the data read by each read step, as memoryviews
+        on the buffer of the transaction, valid until it is run again: a
+        transaction must not be run concurrently with itself.
+        """
+        count, data = yield from pi.i2c_zip(handle, self.compile(),
+                                            self._buffer())
+        return self.split(count, data)
+
+    @asyncio.coroutine
+    def execute_bb(self, pi, SDA):
+        """
+        Runs the transaction on a bit banged I2C bus opened with
+        bb_i2c_open, which needs explicit address, start and stop steps.
+
+        Returns the data read by each read step, see execute.
+        """
+        count, data = yield from pi.bb_i2c_zip(SDA, self.compile(),
+                                               self._buffer())
+        return self.split(count, data)
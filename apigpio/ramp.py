@@ -0,0 +1,205 @@
+import asyncio
+
+from .apigpio import ApigpioError
+
+
+def linear(t):
+    return t
+
+
+def ease_in(t):
+    return t * t
+
+
+def ease_out(t):
+    return t * (2 - t)
+
+
+def ease_in_out(t):
+    return t * t * (3 - 2 * t)
+
+
+class _ramp(object):
+    """A ramp of the PWM dutycycle or servo pulsewidth of a gpio."""
+
+    __slots__ = ('servo', 'start', 'target', 'begin', 'duration', 'curve',
+                 'done', 'sent')
+
+    def __init__(self, servo, start, target, begin, duration, curve, done):
+        self.servo = servo
+        self.start = start
+        self.target = target
+        self.begin = begin
+        self.duration = duration
+        self.curve = curve
+        self.done = done
+        self.sent = None
+
+    def value(self, now):
+        if self.duration <= 0:
+            return self.target
+        t = min(1.0, (now - self.begin) / self.duration)
+        return int(round(self.start + (self.target - self.start) *
+                         self.curve(t)))
+
+
+class Ramper(object):
+    """
+    Runs PWM dutycycle and servo pulsewidth ramps on a Pi.
+
+    All the ramps share a single timer: at each tick the values of all the
+    ramps are computed and the ones which changed are sent in a single
+    Batch. When gpiod answers more slowly than the tick interval, the next
+    tick starts as soon as the previous batch is done, with values for the
+    current time: the intermediate values are skipped rather than queued.
+
+    ...
+    ramper = Ramper(pi)
+    yield from asyncio.gather(
+        ramper.ramp(4, 255, 2.0),                    # fade in over 2 s
+        ramper.ramp(17, 2000, 1.0, servo=True, curve=ease_in_out))
+    ...
+    """
+
+    def __init__(self, pi, interval=0.02):
+        """
+        interval:= the delay in seconds between two ticks.
+        """
+        self._pi = pi
+        self.interval = interval
+        self._ramps = {}
+        # last value sent for each (gpio, servo)
+        self._values = {}
+        self._timer = None
+
+    def __len__(self):
+        return len(self._ramps)
+
+    @asyncio.coroutine
+    def ramp(self, user_gpio, target, duration, servo=False, curve=linear,
+             start=None):
+        """
+        Ramps the PWM dutycycle (or the servo pulsewidth) of a gpio to
+        target over duration seconds, and returns once the target is set.
+
+        user_gpio:= 0-31.
+           target:= the final dutycycle (or pulsewidth).
+         duration:= the duration of the ramp, in seconds.
+            servo:= True to ramp the servo pulsewidth.
+            curve:= a function mapping the elapsed fraction of the ramp
+                    (0.0-1.0) to the fraction of the change, such as
+                    linear, ease_in, ease_out or ease_in_out.
+            start:= the starting value, by default the last value set by
+                    this Ramper or read from gpiod.
+
+        A new ramp of the same gpio replaces the current one, which is
+        then cancelled.
+        """
+        loop = self._pi._loop
+        if start is None:
+            start = yield from self._current(user_gpio, servo, target)
+        done = asyncio.Future(loop=loop)
+        ramp = _ramp(servo, start, target, loop.time(), duration, curve,
+                     done)
+        previous = self._ramps.get(user_gpio)
+        if previous is not None:
+            previous.done.cancel()
+        self._ramps[user_gpio] = ramp
+        if self._timer is None:
+            self._timer = asyncio.async(self._run(), loop=loop)
+        yield from done
+
+    def cancel(self, user_gpio=None):
+        """
+        Stops the ramp of a gpio, or all the ramps if None, leaving the
+        current value in place.
+        """
+        if user_gpio is None:
+            ramps = list(self._ramps.values())
+            self._ramps.clear()
+        else:
+            ramp = self._ramps.pop(user_gpio, None)
+            ramps = [ramp] if ramp is not None else []
+        for ramp in ramps:
+            ramp.done.cancel()
+
+    @asyncio.coroutine
+    def _current(self, user_gpio, servo, target):
+        value = self._values.get((user_gpio, servo))
+        if value is not None:
+            return value
+        cache = self._pi._cache
+        if cache is not None:
+            values = cache.pulsewidths if servo else cache.dutycycles
+            if values[user_gpio] is not None:
+                return values[user_gpio]
+        try:
+            if servo:
+                value = yield from self._pi.get_servo_pulsewidth(user_gpio)
+            else:
+                value = yield from self._pi.get_PWM_dutycycle(user_gpio)
+        except ApigpioError:
+            # no PWM or servo pulses on the gpio yet
+            value = -1
+        if value < 0:
+            # PWM starts from off, servos jump to the target
+            value = target if servo else 0
+        return value
+
+    @asyncio.coroutine
+    def _run(self):
+        pi = self._pi
+        loop = pi._loop
+        try:
+            while self._ramps:
+                tick = loop.time()
+                yield from self._tick(tick)
+                delay = tick + self.interval - loop.time()
+                if delay > 0 and self._ramps:
+                    yield from asyncio.sleep(delay, loop=loop)
+        finally:
+            self._timer = None
+
+    @asyncio.coroutine
+    def _tick(self, now):
+        batch = self._pi.batch(len(self._ramps))
+        sent = []
+        for gpio, ramp in list(self._ramps.items()):
+            if ramp.done.done():
+                # cancelled by its caller
+                del self._ramps[gpio]
+                continue
+            value = ramp.value(now)
+            if value != ramp.sent:
+                if ramp.servo:
+                    batch.set_servo_pulsewidth(gpio, value)
+                else:
+                    batch.set_PWM_dutycycle(gpio, value)
+                sent.append((gpio, ramp, value))
+            elif now >= ramp.begin + ramp.duration:
+                self._finish(gpio, ramp)
+        if not sent:
+            return
+        try:
+            results = yield from batch.execute()
+        except Exception as e:
+            for gpio, ramp, _ in sent:
+                self._finish(gpio, ramp, e)
+            return
+        for (gpio, ramp, value), res in zip(sent, results):
+            if isinstance(res, ApigpioError):
+                self._finish(gpio, ramp, res)
+                continue
+            ramp.sent = value
+            self._values[(gpio, ramp.servo)] = value
+            if value == ramp.target and now >= ramp.begin + ramp.duration:
+                self._finish(gpio, ramp)
+
+    def _finish(self, gpio, ramp, exc=None):
+        if self._ramps.get(gpio) is ramp:
+            del self._ramps[gpio]
+        if not ramp.done.done():
+            if exc is None:
+                ramp.done.set_result(None)
+            else:
+                ramp.done.set_exception(exc)
@@ -0,0 +1,288 @@
+import asyncio
+
+
+class SerialStream(object):
+    """
+    A stream over a serial device opened with serial_open, with an
+    interface similar to asyncio.StreamReader.
+
+    gpiod does not notify the arrival of serial data: the stream polls the
+    number of bytes available, waiting longer and longer between polls
+    while the device is idle (up to max_interval) and polling again right
+    away while data flows. Data is read in chunks of up to chunk bytes.
+
+    ...
+    h = yield from pi.serial_open('/dev/ttyAMA0', 9600)
+    gps = SerialStream(pi, h)
+    yield from gps.start()
+    while True:
+        line = yield from gps.readline()
+        ...
+    ...
+    """
+
+    def __init__(self, pi, handle, chunk=4096, min_interval=0.002,
+                 max_interval=0.1, write_chunk=4096):
+        """
+              handle:= a handle returned by serial_open.
+               chunk:= maximum number of bytes read at once.
+        min_interval:= delay in seconds between polls right after data was
+                       received.
+        max_interval:= longest delay in seconds between polls of an idle
+                       device.
+         write_chunk:= maximum number of bytes sent by a single serial
+                       write command.
+        """
+        self._pi = pi
+        self._handle = handle
+        self.chunk = chunk
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.write_chunk = write_chunk
+        self._buffer = bytearray()
+        self._waiter = None
+        self._poller = None
+        self._eof = False
+        # the error which stopped the polling, if any
+        self.exception = None
+
+    @asyncio.coroutine
+    def start(self):
+        """Starts polling the device."""
+        if self._poller is None:
+            self._eof = False
+            self._poller = asyncio.async(self._poll(), loop=self._pi._loop)
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Stops polling the device, which is not closed. The data already
+        received can still be read.
+        """
+        poller, self._poller = self._poller, None
+        if poller is not None:
+            poller.cancel()
+            try:
+                yield from poller
+            except asyncio.CancelledError:
+                pass
+        self._eof = True
+        self._wakeup()
+
+    def at_eof(self):
+        """Returns True if the stream is closed and its buffer empty."""
+        return self._eof and not self._buffer
+
+    def _wakeup(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    @asyncio.coroutine
+    def _poll(self):
+        pi = self._pi
+        handle = self._handle
+        buf = bytearray(self.chunk)
+        interval = self.min_interval
+        try:
+            while True:
+                available = yield from pi.serial_data_available(handle)
+                if available > 0:
+                    count, data = yield from pi.serial_read(
+                        handle, min(available, self.chunk), buf)
+                    if count > 0:
+                        self._buffer += data
+                        self._wakeup()
+                        interval = self.min_interval
+                        continue
+                yield from asyncio.sleep(interval, loop=pi._loop)
+                interval = min(interval * 2, self.max_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # gpiod or the connection failed
+            self.exception = e
+            self._eof = True
+            self._wakeup()
+
+    @asyncio.coroutine
+    def _wait_for_data(self):
+        if self.exception is not None:
+            raise self.exception
+        if self._eof:
+            return
+        self._waiter = asyncio.Future(loop=self._pi._loop)
+        yield from self._waiter
+        if self.exception is not None:
+            raise self.exception
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        """
+        Reads up to n bytes, all the bytes available if n is -1, waiting
+        for at least one byte. Returns b'' at end of stream.
+        """
+        if not n:
+            return b''
+        if not self._buffer:
+            yield from self._wait_for_data()
+        if n < 0 or n >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:n])
+            del self._buffer[:n]
+        return data
+
+    @asyncio.coroutine
+    def readexactly(self, n):
+        """
+        Reads exactly n bytes, raises asyncio.IncompleteReadError if the
+        stream is closed before.
+        """
+        while len(self._buffer) < n:
+            if self._eof:
+                partial = bytes(self._buffer)
+                self._buffer.clear()
+                raise asyncio.IncompleteReadError(partial, n)
+            yield from self._wait_for_data()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    @asyncio.coroutine
+    def readuntil(self, separator=b'\n'):
+        """
+        Reads data up to and including separator, raises
+        asyncio.IncompleteReadError if the stream is closed before.
+        """
+        start = 0
+        while True:
+            pos = self._buffer.find(separator, start)
+            if pos >= 0:
+                break
+            if self._eof:
+                partial = bytes(self._buffer)
+                self._buffer.clear()
+                raise asyncio.IncompleteReadError(partial, None)
+            start = max(0, len(self._buffer) - len(separator) + 1)
+            yield from self._wait_for_data()
+        end = pos + len(separator)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+    @asyncio.coroutine
+    def readline(self):
+        """
+        Reads a line ending with b'\\n', or the remaining data at end of
+        stream.
+        """
+        try:
+            line = yield from self.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        return line
+
+    @asyncio.coroutine
+    def write(self, data):
+        """Writes data, in chunks of up to write_chunk bytes."""
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), self.write_chunk):
+            yield from self._pi.serial_write(
+                self._handle, view[start:start + self.write_chunk])
+
+
+class BitBangSerialReader(object):
+    """
+    Receives bit bang serial data on a gpio, as an asynchronous iterator
+    of the chunks of data read.
+
+    The cyclic buffer of gpiod is drained with reads of up to chunk bytes
+    into a reusable buffer, polled like SerialStream: right away while
+    data flows, less and less often while the gpio is idle.
+
+    ...
+    reader = BitBangSerialReader(pi, 17, 9600)
+    yield from reader.open()
+    async for data in reader:
+        ...
+    ...
+    """
+
+    def __init__(self, pi, user_gpio, baud, bb_bits=8, invert=False,
+                 chunk=10000, min_interval=0.002, max_interval=0.1):
+        """
+           user_gpio:= 0-31, the gpio receiving the data.
+                baud:= 50-250000.
+             bb_bits:= 1-32, see bb_serial_read for the size of the
+                        characters in the data.
+              invert:= True to invert the serial logic.
+               chunk:= maximum number of bytes read at once, at most 10000.
+        min_interval:= delay in seconds between polls right after data was
+                       received.
+        max_interval:= longest delay in seconds between polls of an idle
+                       gpio.
+        """
+        self._pi = pi
+        self.gpio = user_gpio
+        self.baud = baud
+        self.bb_bits = bb_bits
+        self.invert = invert
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._buf = bytearray(chunk)
+        self._interval = min_interval
+        self._closed = True
+
+    @asyncio.coroutine
+    def open(self):
+        """Opens the gpio for bit bang serial reading."""
+        yield from self._pi.bb_serial_read_open(self.gpio, self.baud,
+                                                self.bb_bits)
+        if self.invert:
+            yield from self._pi.bb_serial_invert(self.gpio, 1)
+        self._closed = False
+
+    @asyncio.coroutine
+    def close(self):
+        """Closes the gpio, iterations over the reader then stop."""
+        if not self._closed:
+            self._closed = True
+            yield from self._pi.bb_serial_read_close(self.gpio)
+
+    @asyncio.coroutine
+    def read(self):
+        """
+        Waits for data and returns it, as a memoryview on the buffer of the
+        reader valid until the next read, or b'' once closed.
+        """
+        pi = self._pi
+        while not self._closed:
+            count, data = yield from pi.bb_serial_read(
+                self.gpio, len(self._buf), self._buf)
+            if count > 0:
+                self._interval = self.min_interval
+                return data
+            yield from asyncio.sleep(self._interval, loop=pi._loop)
+            self._interval = min(self._interval * 2, self.max_interval)
+        return b''
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        yield from self.open()
+        return self
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc, tb):
+        yield from self.close()
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        data = yield from self.read()
+        if not data:
+            raise StopAsyncIteration
+        return bytes(data)
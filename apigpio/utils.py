@@ -1,56 +1,200 @@
+import asyncio
 import functools
+import weakref
 
+from .ctes import DEBOUNCE_LEADING, DEBOUNCE_TRAILING, DEBOUNCE_SETTLE
 
-def Debounce(threshold=100):
+_MAX_TICK = 0xFFFFFFFF
+
+# maximum steady time of gpiod glitch filter, in microseconds
+_MAX_GLITCH_FILTER = 300000
+
+
+def Debounce(threshold=100, mode=DEBOUNCE_LEADING, loop=None):
     """
-    Simple debouncing decorator for apigpio callbacks.
+    Debouncing decorator for apigpio callbacks.
 
     Example:
 
-    `@Debouncer()
+    `@Debounce()
      def my_cb(gpio, level, tick)
          print('gpio cb: {} {} {}'.format(gpio, level, tick))
     `
 
     The threshold can be given to the decorator as an argument (in millisec).
-    This decorator can be used both on function and object's methods.
+    This decorator can be used both on function and object's methods, the
+    debouncing state is kept for each gpio (and each object for methods).
+
+    The mode can be one of:
+
+    DEBOUNCE_LEADING: the first call is passed, following calls are
+      filtered out until threshold has elapsed since the last passed call.
+    DEBOUNCE_TRAILING: the last call is passed, once no other call has been
+      made for threshold.
+    DEBOUNCE_SETTLE: like DEBOUNCE_TRAILING, but the call is only passed if
+      the level differs from the level of the last passed call.
+
+    The number of passed and filtered calls are available in the accepted
+    and filtered attributes of the decorated callback, and for a given
+    gpio with its stats() method.
+
+    The filtering can also be offloaded to gpiod with the offload()
+    coroutine, which sets a glitch filter on the gpio, calls for this gpio
+    are then all passed.
 
-    Warning: as the debouncer uses the tick from pigpio, which wraps around
-    after approximately 1 hour 12 minutes, you could theoretically miss one
-    call if your callback is called twice with that interval.
+    Note: the leading mode uses the tick from pigpio, the trailing and settle
+    modes use the time and the timers of the event loop given as loop, the
+    loop of the Pi, by default the current event loop.
+
+    Only plain functions can be debounced: the calls of a coroutine
+    function could not be run in order nor have their errors reported.
     """
-    threshold *= 1000
-    max_tick = 0xFFFFFFFF
+    if mode not in (DEBOUNCE_LEADING, DEBOUNCE_TRAILING, DEBOUNCE_SETTLE):
+        raise ValueError('unknown debounce mode {}'.format(mode))
+    if loop is None:
+        loop = asyncio.get_event_loop()
 
-    class _decorated(object):
+    def _decorate(pigpio_cb):
+        if asyncio.iscoroutinefunction(pigpio_cb):
+            raise TypeError('Debounce can not decorate a coroutine function')
+        return _Debounced(pigpio_cb, threshold, mode, loop)
 
-        def __init__(self, pigpio_cb):
-            self._fn = pigpio_cb
-            self.last = 0
-            self.is_method = False
+    return _decorate
 
-        def __call__(self, *args, **kwargs):
-            if self.is_method:
-                tick = args[3]
-            else:
-                tick = args[2]
-            if self.last > tick:
-                delay = max_tick-self.last + tick
-            else:
-                delay = tick - self.last
-            if delay > threshold:
-                self._fn(*args, **kwargs)
-                print('call passed by debouncer {} {} {}'
-                      .format(tick, self.last, threshold))
-                self.last = tick
+
+class _DebounceState(object):
+    """Debouncing state of a gpio, for a callback (and object)."""
+
+    __slots__ = ('last', 'level', 'event', 'event_time', 'timer', 'args',
+                 'kwargs', 'accepted', 'filtered')
+
+    def __init__(self):
+        self.last = None
+        self.event = None
+        self.level = None
+        self.event_time = 0
+        self.timer = None
+        self.args = None
+        self.kwargs = None
+        self.accepted = 0
+        self.filtered = 0
+
+
+class _Debounced(object):
+
+    def __init__(self, pigpio_cb, threshold, mode, loop):
+        functools.update_wrapper(self, pigpio_cb)
+        self._fn = pigpio_cb
+        self._loop = loop
+        self.threshold = threshold
+        self.mode = mode
+        self._states = {}
+        # states of the objects the callback is a method of
+        self._instances = weakref.WeakKeyDictionary()
+        self._offloaded = set()
+        self.accepted = 0
+        self.filtered = 0
+
+    def __call__(self, gpio, level, tick, *args, **kwargs):
+        self._filter(self._states, (), gpio, level, tick, args, kwargs)
+
+    def __get__(self, instance, type=None):
+        # with is called when an instance of `_Debounced` is used as a class
+        # attribute, which is the case when decorating a method in a class
+        if instance is None:
+            return self
+        return functools.partial(self._call_method, instance)
+
+    def _call_method(self, instance, gpio, level, tick, *args, **kwargs):
+        try:
+            states = self._instances[instance]
+        except KeyError:
+            states = self._instances[instance] = {}
+        self._filter(states, (instance,), gpio, level, tick, args, kwargs)
+
+    def stats(self, gpio, instance=None):
+        """
+        Returns the (accepted, filtered) counts for a gpio (and object).
+        """
+        if instance is None:
+            states = self._states
+        else:
+            states = self._instances.get(instance, {})
+        state = states.get(gpio)
+        if state is None:
+            return 0, 0
+        return state.accepted, state.filtered
+
+    @asyncio.coroutine
+    def offload(self, pi, gpio):
+        """
+        Offloads the debouncing of a gpio to gpiod, by setting a glitch
+        filter with the threshold as steady time.
+
+        Only possible for thresholds up to 300 ms.
+        """
+        steady = self.threshold * 1000
+        if steady > _MAX_GLITCH_FILTER:
+            raise ValueError('threshold too large for a glitch filter')
+        yield from pi.set_glitch_filter(gpio, steady)
+        self._offloaded.add(gpio)
+
+    @asyncio.coroutine
+    def restore(self, pi, gpio):
+        """Removes the glitch filter set by offload."""
+        yield from pi.set_glitch_filter(gpio, 0)
+        self._offloaded.discard(gpio)
+
+    def _filter(self, states, prefix, gpio, level, tick, args, kwargs):
+        state = states.get(gpio)
+        if state is None:
+            state = states[gpio] = _DebounceState()
+
+        if gpio in self._offloaded:
+            self._accept(state, prefix, gpio, level, tick, args, kwargs)
+        elif self.mode == DEBOUNCE_LEADING:
+            # ticks wrap around, the delay is their difference modulo 2**32
+            if state.last is None or \
+                    (tick - state.last) & _MAX_TICK > self.threshold * 1000:
+                state.last = tick
+                self._accept(state, prefix, gpio, level, tick, args, kwargs)
             else:
-                print('call filtered out by debouncer {} {} {}'
-                      .format(tick, self.last, threshold))
+                self._reject(state)
+        else:
+            loop = self._loop
+            if state.timer is not None:
+                # superseded by this call
+                self._reject(state)
+            state.event_time = loop.time()
+            state.event = (prefix, gpio, level, tick)
+            state.args = args
+            state.kwargs = kwargs
+            if state.timer is None:
+                state.timer = loop.call_later(self.threshold / 1000,
+                                              self._on_quiet, state)
+
+    def _on_quiet(self, state):
+        loop = self._loop
+        remaining = state.event_time + self.threshold / 1000 - loop.time()
+        if remaining > 0:
+            # calls were made since the timer was started
+            state.timer = loop.call_later(remaining, self._on_quiet, state)
+            return
+        state.timer = None
+        prefix, gpio, level, tick = state.event
+        args, kwargs = state.args, state.kwargs
+        state.event = state.args = state.kwargs = None
+        if self.mode == DEBOUNCE_SETTLE and level == state.level:
+            self._reject(state)
+        else:
+            self._accept(state, prefix, gpio, level, tick, args, kwargs)
 
-        def __get__(self, instance, type=None):
-            # with is called when an instance of `_decorated` is used as a class
-            # attribute, which is the case when decorating a method in a class
-            self.is_method = True
-            return functools.partial(self, instance)
+    def _accept(self, state, prefix, gpio, level, tick, args, kwargs):
+        state.accepted += 1
+        self.accepted += 1
+        state.level = level
+        self._fn(*(prefix + (gpio, level, tick) + args), **kwargs)
 
-    return _decorated
+    def _reject(self, state):
+        state.filtered += 1
+        self.filtered += 1
@@ -0,0 +1,331 @@
+import array
+import asyncio
+import collections
+import sys
+
+from .ctes import PI_NO_WAVEFORM_ID, PI_TOO_MANY_CBS, PI_TOO_MANY_OOL
+
+
+Pulse = collections.namedtuple('Pulse', ['gpio_on', 'gpio_off', 'delay'])
+Pulse.__doc__ = """
+A waveform pulse.
+
+gpio_on:= the bits of the gpios to be switched on at the start of
+          the pulse.
+gpio_off:= the bits of the gpios to be switched off at the start of
+           the pulse.
+delay:= the delay in microseconds before the next pulse.
+"""
+
+
+def _bits(gpios):
+    if isinstance(gpios, int):
+        return 1 << gpios
+    bits = 0
+    for gpio in gpios:
+        bits |= 1 << gpio
+    return bits
+
+
+def pack_pulses(pulses):
+    """
+    Returns a buffer holding pulses in the gpiod WVAG layout: 3 unsigned 32
+    bit integers (gpio_on, gpio_off, delay) per pulse.
+
+    pulses:= a WaveBuilder, an array('I') of flattened pulses, a NumPy
+             array of shape (n, 3) or flattened, or an iterable of
+             (gpio_on, gpio_off, delay) tuples such as Pulse.
+
+    Arrays are used as they are, without any per pulse processing, when
+    they already have the right item type.
+    """
+    if isinstance(pulses, WaveBuilder):
+        pulses = pulses.pulses
+    # numpy is only looked for, not imported: a NumPy array can only be
+    # given if it has already been imported.
+    np = sys.modules.get('numpy')
+    if isinstance(pulses, array.array) and pulses.itemsize == 4 and \
+            pulses.typecode in 'IL':
+        data = pulses
+    elif np is not None and isinstance(pulses, np.ndarray):
+        data = np.ascontiguousarray(pulses, dtype=np.uint32).reshape(-1)
+    else:
+        data = array.array('I')
+        for gpio_on, gpio_off, delay in pulses:
+            data.append(gpio_on)
+            data.append(gpio_off)
+            data.append(delay)
+    if len(data) % 3:
+        raise ValueError('pulses must be made of 3 integers')
+    return data
+
+
+class WaveBuilder(object):
+    """
+    Builds the pulses of a waveform, directly in the layout expected by
+    gpiod.
+
+    ...
+    w = apigpio.wave.WaveBuilder()
+    for _ in range(100):
+        w.set(18, 10)
+        w.clear(18, 30)
+    wid = yield from pi.wave_create_from(w)
+    yield from pi.wave_send_once(wid)
+    ...
+    """
+
+    def __init__(self):
+        self.pulses = array.array('I')
+
+    def __len__(self):
+        return len(self.pulses) // 3
+
+    def pulse(self, gpio_on, gpio_off, delay):
+        """
+        Adds a pulse given as gpio bits.
+
+        gpio_on:= the bits of the gpios to switch on.
+        gpio_off:= the bits of the gpios to switch off.
+        delay:= delay in microseconds before the next pulse.
+        """
+        self.pulses.extend((gpio_on, gpio_off, delay))
+        return self
+
+    def set(self, gpios, delay):
+        """
+        Switches on a gpio, or a sequence of gpios, then waits delay
+        microseconds.
+        """
+        return self.pulse(_bits(gpios), 0, delay)
+
+    def clear(self, gpios, delay):
+        """
+        Switches off a gpio, or a sequence of gpios, then waits delay
+        microseconds.
+        """
+        return self.pulse(0, _bits(gpios), delay)
+
+    def delay(self, delay):
+        """Waits delay microseconds without changing any gpio."""
+        return self.pulse(0, 0, delay)
+
+    def extend(self, pulses):
+        """Adds pulses, see pack_pulses for the accepted types."""
+        data = pack_pulses(pulses)
+        if isinstance(data, array.array) and data.typecode == 'I':
+            self.pulses.extend(data)
+        else:
+            self.pulses.frombytes(memoryview(data).cast('B'))
+        return self
+
+    def duration(self):
+        """Returns the duration of the waveform in microseconds."""
+        return sum(self.pulses[2::3])
+
+
+# gpiod wave chain commands
+_CHAIN_LOOP_START = b'\xff\x00'
+_CHAIN_LOOP_END = b'\xff\x01'
+_CHAIN_DELAY = b'\xff\x02'
+_CHAIN_FOREVER = b'\xff\x03'
+
+# largest count or delay of a chain command
+_CHAIN_MAX = 0xFFFF
+# maximum nesting of chain loops
+_CHAIN_NESTING = 4
+
+# errors of gpiod which may be solved by deleting waveforms, unlike
+# PI_TOO_MANY_PULSES which is a limit of each waveform.
+_WAVE_EXHAUSTED = (PI_NO_WAVEFORM_ID, PI_TOO_MANY_CBS, PI_TOO_MANY_OOL)
+
+
+class WaveChain(object):
+    """
+    A high level sequence of waveforms, compiled into a gpiod wave chain.
+
+    A sequence is made of segments (pulses), delays and loops of other
+    sequences. Identical segments share the same waveform in gpiod, and
+    waveforms are kept in the wave cache of the Pi between calls, so that
+    sending the same or a similar sequence again only creates the
+    segments which are new.
+
+    ...
+    chain = apigpio.wave.WaveChain()
+    chain.add(preamble)
+    step = chain.loop(200)
+    step.add(step_pulses)
+    step.delay(2000)
+    yield from pi.wave_send_chain(chain)
+    ...
+    """
+
+    def __init__(self, max_pulses=2000):
+        """
+        max_pulses:= segments longer than this are split in several
+                     waveforms.
+        """
+        self.max_pulses = max_pulses
+        # ('segment', data) / ('delay', us) / ('loop', count, WaveChain)
+        self.items = []
+        self.forever = False
+
+    def add(self, pulses):
+        """Adds a segment of pulses, see pack_pulses for the types."""
+        data = pack_pulses(pulses)
+        step = self.max_pulses * 3
+        for start in range(0, len(data), step):
+            chunk = bytes(memoryview(data[start:start + step]).cast('B'))
+            self.items.append(('segment', chunk))
+        return self
+
+    def delay(self, delay):
+        """Adds a delay in microseconds."""
+        while delay > 0:
+            part = min(delay, _CHAIN_MAX)
+            self.items.append(('delay', part))
+            delay -= part
+        return self
+
+    def loop(self, count):
+        """
+        Adds a loop repeating a sequence count times (1-65535) and returns
+        that sequence, to which the items to repeat are added.
+        """
+        if not 1 <= count <= _CHAIN_MAX:
+            raise ValueError('loop count must be 1-65535')
+        body = WaveChain(self.max_pulses)
+        self.items.append(('loop', count, body))
+        return body
+
+    def repeat_forever(self):
+        """Repeats the whole sequence until wave_tx_stop is called."""
+        self.forever = True
+        return self
+
+    def segments(self):
+        """Yields the data of all the segments, loops included."""
+        for item in self.items:
+            if item[0] == 'segment':
+                yield item[1]
+            elif item[0] == 'loop':
+                for data in item[2].segments():
+                    yield data
+
+    def compile(self, wave_ids):
+        """
+        Returns the gpiod chain bytes of the sequence.
+
+        wave_ids:= a mapping of the segment data to their wave id.
+        """
+        chain = bytearray()
+        self._compile(chain, wave_ids, 0)
+        if self.forever:
+            chain[:0] = _CHAIN_LOOP_START
+            chain += _CHAIN_FOREVER
+        return bytes(chain)
+
+    def _compile(self, chain, wave_ids, depth):
+        for item in self.items:
+            kind = item[0]
+            if kind == 'segment':
+                chain.append(wave_ids[item[1]])
+            elif kind == 'delay':
+                chain += _CHAIN_DELAY
+                chain += item[1].to_bytes(2, 'little')
+            elif item[1] == 1:
+                item[2]._compile(chain, wave_ids, depth)
+            else:
+                if depth == _CHAIN_NESTING:
+                    raise ValueError('wave chain loops nested too deeply')
+                chain += _CHAIN_LOOP_START
+                item[2]._compile(chain, wave_ids, depth + 1)
+                chain += _CHAIN_LOOP_END
+                chain += item[1].to_bytes(2, 'little')
+
+
+class WaveCache(object):
+    """
+    The waveforms created in gpiod by a Pi for its wave chains, by segment
+    data, in least recently used order.
+
+    When gpiod runs out of wave ids or of space for a new waveform, the
+    least recently used waveforms are deleted, which must not be
+    transmitting anymore.
+    """
+
+    def __init__(self, pi, capacity=250):
+        """
+        capacity:= maximum number of waveforms kept in gpiod.
+        """
+        self._pi = pi
+        self.capacity = capacity
+        self._waves = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._waves)
+
+    def clear(self):
+        """Forgets all the waveforms, for example after wave_clear."""
+        self._waves.clear()
+
+    def discard(self, wave_id):
+        """Forgets a waveform deleted from gpiod."""
+        for data, wid in list(self._waves.items()):
+            if wid == wave_id:
+                del self._waves[data]
+
+    @asyncio.coroutine
+    def wave_ids(self, chain):
+        """
+        Returns the mapping of the segments of a WaveChain to their wave id,
+        creating the waveforms which are not cached yet.
+        """
+        ids = {}
+        missing = []
+        # cached waveforms are marked as used first, so that they are not
+        # evicted to create the missing ones.
+        for data in chain.segments():
+            if data in ids or data in missing:
+                continue
+            wave_id = self._waves.get(data)
+            if wave_id is None:
+                missing.append(data)
+            else:
+                self._waves.move_to_end(data)
+                ids[data] = wave_id
+        for data in missing:
+            wave_id = yield from self._create(data, ids)
+            self._waves[data] = wave_id
+            ids[data] = wave_id
+        return ids
+
+    @asyncio.coroutine
+    def _create(self, data, used):
+        from .apigpio import ApigpioError, error_text
+        pulses = array.array('I')
+        pulses.frombytes(data)
+        while True:
+            if len(self._waves) >= self.capacity:
+                yield from self._pi.wave_delete(self._evict(used))
+            try:
+                wave_id = yield from self._pi.wave_create_from(pulses)
+            except ApigpioError as e:
+                if e.code not in _WAVE_EXHAUSTED:
+                    raise
+            else:
+                if wave_id >= 0:
+                    return wave_id
+                if wave_id not in _WAVE_EXHAUSTED:
+                    raise ApigpioError(error_text(wave_id), wave_id)
+            yield from self._pi.wave_delete(self._evict(used))
+
+    def _evict(self, used):
+        # removes and returns the least recently used waveform which is not
+        # used by the chain being compiled.
+        used = set(used.values())
+        for data, wave_id in self._waves.items():
+            if wave_id not in used:
+                del self._waves[data]
+                return wave_id
+        raise ValueError('wave chain needs more waveforms than gpiod has')
@@ -26,5 +26,6 @@ setup(name='apigpio',
       url='https://github.com/PierreRust/apigpio',
       download_url = 'https://github.com/PierreRust/apigpio/archive/0.0.2.tar.gz', 
       keywords=['gpio', 'pigpio', 'asyncio', 'raspberry'],
-      packages=find_packages()
+      packages=find_packages(),
+      extras_require={'numpy': ['numpy']}
       )
@@ -0,0 +1,119 @@
+import asyncio
+import struct
+import unittest
+
+from apigpio.apigpio import ApigpioError, _command_channel
+
+_CMD = struct.Struct('IIII')
+
+
+def _pack(p1, extent=b''):
+    return _CMD.pack(1, p1, 0, len(extent)) + extent
+
+
+class _EchoServer(object):
+    """
+    A loopback server answering each command with its p1 parameter, once
+    the gate is open.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.gate = asyncio.Event(loop=loop)
+        self.received = []
+        self.server = None
+
+    @asyncio.coroutine
+    def start(self):
+        self.server = yield from asyncio.start_server(
+            self._handle, '127.0.0.1', 0, loop=self._loop)
+        return self.server.sockets[0].getsockname()
+
+    @asyncio.coroutine
+    def _handle(self, reader, writer):
+        yield from self.gate.wait()
+        try:
+            while True:
+                cmd, p1, p2, p3 = _CMD.unpack(
+                    (yield from reader.readexactly(_CMD.size)))
+                yield from reader.readexactly(p3)
+                self.received.append(p1)
+                writer.write(_CMD.pack(cmd, p1, p2, p1))
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    @asyncio.coroutine
+    def close(self):
+        self.server.close()
+        yield from self.server.wait_closed()
+
+
+class CommandChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = _EchoServer(self.loop)
+        address = self.loop.run_until_complete(self.server.start())
+        self.channel = _command_channel(self.loop)
+        self.loop.run_until_complete(self.channel.connect(address))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.channel.close())
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+
+    def test_pipelined_commands_get_their_own_response(self):
+        self.server.gate.set()
+
+        @asyncio.coroutine
+        def run():
+            commands = [self.channel.command(_pack(i)) for i in range(50)]
+            batch = self.channel.commands(_pack(100) + _pack(101),
+                                          [(False, None), (False, None)])
+            return (yield from asyncio.gather(batch, *commands,
+                                              loop=self.loop))
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(results[0], [100, 101])
+        self.assertEqual(results[1:], list(range(50)))
+        self.assertEqual(self.channel.outstanding, 0)
+
+    def test_cancelled_write_keeps_responses_in_order(self):
+        # a large command which can't be written at once while the server
+        # is not reading.
+        big = _pack(7, bytes(16 * 1024 * 1024))
+
+        @asyncio.coroutine
+        def run():
+            task = asyncio.async(self.channel.command(big), loop=self.loop)
+            yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertFalse(task.done())
+            task.cancel()
+            self.server.gate.set()
+            return (yield from asyncio.wait_for(
+                self.channel.command(_pack(9)), 5, loop=self.loop))
+
+        self.assertEqual(self.loop.run_until_complete(run()), 9)
+        self.assertEqual(self.server.received, [7, 9])
+
+    def test_failed_write_fails_the_channel(self):
+        self.server.gate.set()
+        failed = asyncio.Future(loop=self.loop)
+        failed.set_exception(OSError('broken pipe'))
+        sock_sendall = self.loop.sock_sendall
+        self.loop.sock_sendall = lambda sock, data: failed
+
+        @asyncio.coroutine
+        def run():
+            with self.assertRaises(OSError):
+                yield from self.channel.command(_pack(1))
+            self.loop.sock_sendall = sock_sendall
+            with self.assertRaises(ApigpioError):
+                yield from self.channel.command(_pack(2))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(self.channel.outstanding, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()